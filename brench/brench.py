@@ -8,20 +8,153 @@ import re
 import csv
 import sys
 import os
+import signal
+import statistics
+import math
+import threading
+import time
+import queue
+import contextlib
+import hashlib
+import io
+import json
+import shlex
+import shutil
+from collections import namedtuple
 from concurrent import futures
+from functools import lru_cache
 import glob
 
 __version__ = '1.0.0'
 
 ARGS_RE = r'ARGS: (.*)'
 
+# The resources used by a pipeline: the total CPU time (user plus
+# system, in seconds) of all its processes, and the largest maximum
+# resident set size (in KiB) of any one of them.
+Usage = namedtuple('Usage', ['cpu_time', 'max_rss'])
+
+# One execution of a run's pipeline: the stdout and stderr of its final
+# command, its `Usage`, and its wall-clock time in seconds (both None for
+# a result from the cache).
+Trial = namedtuple('Trial', ['stdout', 'stderr', 'usage', 'secs'])
+
+# Statistics for the samples from repeated trials, after dropping
+# outliers. `samples` is the number of samples kept.
+Summary = namedtuple('Summary', ['mean', 'median', 'stddev', 'min',
+                                 'ci_low', 'ci_high', 'samples',
+                                 'outliers'])
+
+STATS_COLUMNS = list(Summary._fields)
+
+# Two-sided 95% critical values of Student's t distribution, for 1 to
+# 30 degrees of freedom.
+T_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def physical_cores():
+    """Group the CPUs this process may run on by physical core.
+
+    Return a list with a set of CPU numbers for each core (more than one
+    CPU when the core has several hardware threads). Where the topology
+    is not available, every CPU counts as its own core.
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return [{cpu} for cpu in range(os.cpu_count() or 1)]
+
+    cores = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        topo = '/sys/devices/system/cpu/cpu{}/topology/'.format(cpu)
+        try:
+            with open(topo + 'physical_package_id') as f:
+                package = f.read().strip()
+            with open(topo + 'core_id') as f:
+                core = f.read().strip()
+        except OSError:
+            key = cpu
+        else:
+            key = (package, core)
+        cores.setdefault(key, set()).add(cpu)
+    return list(cores.values())
+
+
+def _communicate(procs, input, timeout):
+    """Send input to the first process in a pipeline and read all of the
+    last process's stdout and stderr.
+
+    This is like `Popen.communicate`, except that it does not wait for
+    the processes to exit, so we can collect their resource usage
+    ourselves. Raise `TimeoutExpired` if the output is not finished in
+    time.
+    """
+    out = {}
+
+    def write():
+        try:
+            with procs[0].stdin as stream:
+                stream.write(input)
+        except BrokenPipeError:
+            pass  # The pipeline does not read all its input.
+
+    def read(name, stream):
+        with stream:
+            out[name] = stream.read()
+
+    threading.Thread(target=write, daemon=True).start()
+    readers = [
+        threading.Thread(target=read, args=(name, stream), daemon=True)
+        for name, stream in (('stdout', procs[-1].stdout),
+                             ('stderr', procs[-1].stderr))
+    ]
+    for reader in readers:
+        reader.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for reader in readers:
+        reader.join(None if deadline is None
+                    else max(0, deadline - time.monotonic()))
+        if reader.is_alive():
+            raise subprocess.TimeoutExpired(procs[-1].args, timeout)
+    return out['stdout'], out['stderr']
+
+
+def _reap(procs, wait_last):
+    """Kill and reap the processes in a pipeline and return their
+    combined `Usage`. If `wait_last`, let the final process exit on its
+    own instead of killing it.
+    """
+    cpu_time = 0.0
+    max_rss = 0
+    for i, proc in enumerate(procs):
+        if not (wait_last and i == len(procs) - 1):
+            try:
+                os.kill(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if not hasattr(os, 'wait4'):
+            proc.wait()
+            continue
+
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                           else os.WEXITSTATUS(status))
+        cpu_time += ru.ru_utime + ru.ru_stime
+        max_rss = max(max_rss, ru.ru_maxrss)
+
+    return Usage(cpu_time, max_rss) if hasattr(os, 'wait4') else None
+
 
 def run_pipe(cmds, input, timeout):
     """Execute a pipeline of shell commands.
 
-    Send the given input (text) string into the first command, then pipe
-    the output of each command into the next command in the sequence.
-    Collect and return the stdout and stderr from the final command.
+    Send the given input (bytes) into the first command, then pipe the
+    output of each command into the next command in the sequence.
+    Collect and return the stdout and stderr (bytes) from the final
+    command, and the `Usage` of the whole pipeline (or None where the
+    platform cannot measure it).
     """
     procs = []
     for cmd in cmds:
@@ -29,40 +162,369 @@ def run_pipe(cmds, input, timeout):
         proc = subprocess.Popen(
             cmd,
             shell=True,
-            text=True,
             stdin=procs[-1].stdout if procs else subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE if last else subprocess.DEVNULL,
         )
+        if procs:
+            # Only the next command reads this output now.
+            procs[-1].stdout.close()
         procs.append(proc)
 
     try:
-        # Send stdin and collect stdout.
-        procs[0].stdin.write(input)
-        procs[0].stdin.close()
-        return procs[-1].communicate(timeout=timeout)
+        stdout, stderr = _communicate(procs, input, timeout)
+    except BaseException:
+        _reap(procs, False)
+        raise
+
+    # The last command has finished its output. Any earlier commands
+    # still running are no longer needed.
+    return stdout, stderr, _reap(procs, True)
+
+
+def _text(data):
+    """Decode a command's output the way `Popen` does in text mode.
+    """
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'brench')
+
+
+@lru_cache(maxsize=None)
+def _file_stamp(path):
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_mtime_ns, st.st_size]
+
+
+def tool_stamps(cmds):
+    """Identify the files that a pipeline runs: the executable for each
+    command (looked up on the PATH) and any arguments that name existing
+    files (like scripts), by resolved path, modification time, and size.
+
+    Files that are not mentioned in the commands (like modules imported
+    by a script) are not included.
+    """
+    stamps = []
+    for cmd in cmds:
+        try:
+            words = shlex.split(cmd)
+        except ValueError:
+            continue
+        for i, word in enumerate(words):
+            path = shutil.which(word) if i == 0 else None
+            if path is None and os.path.isfile(word):
+                path = word
+            if path is not None:
+                stamps.append(_file_stamp(path))
+    return stamps
+
+
+def cache_key(in_data, cmds, args, timeout):
+    """Compute the cache key for running a pipeline on a benchmark: a
+    hash of everything that determines the result.
+    """
+    ident = {
+        'input': hashlib.sha256(in_data).hexdigest(),
+        'cmds': cmds,
+        'args': args,
+        'tools': tool_stamps(cmds),
+        'timeout': timeout,
+    }
+    return hashlib.sha256(
+        json.dumps(ident, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class ResultCache:
+    """An on-disk cache of pipeline results, addressed by `cache_key`.
+
+    Every entry is a small JSON file. Reading an entry updates its
+    modification time, so `evict` can drop the least recently used
+    entries first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.json')
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write atomically, in case another run reads the entry.
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                    threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def evict(self, max_bytes):
+        """Delete the least recently used entries until the cache takes
+        up at most `max_bytes`.
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))  # If it is now empty.
+            except OSError:
+                pass
+            total -= size
+
+
+def run_cmds(cmds, input, timeout, cpus=None):
+    """Run a pipeline with `run_pipe`. If `cpus` is a queue of CPU sets,
+    take one and confine the pipeline to it while it runs.
+
+    Return `run_pipe`'s results and the number of seconds the pipeline
+    took (not counting the wait for CPUs).
+    """
+    if cpus is None:
+        start = time.monotonic()
+        return run_pipe(cmds, input, timeout) + (time.monotonic() - start,)
+
+    cpu_set = cpus.get()
+    try:
+        # Child processes inherit the affinity of the thread that starts
+        # them.
+        os.sched_setaffinity(0, cpu_set)
+        start = time.monotonic()
+        return run_pipe(cmds, input, timeout) + (time.monotonic() - start,)
     finally:
-        for proc in procs:
-            proc.kill()
+        cpus.put(cpu_set)
+
 
+class Stage:
+    """A node in a prefix tree of pipelines.
 
-def run_bench(pipeline, fn, timeout):
-    """Run a single benchmark pipeline.
+    A stage holds the commands that come after its parent's commands in
+    every pipeline that goes through it, the names of the runs whose
+    pipelines end here, and the child stages, keyed by their first
+    command.
     """
-    # Load the benchmark.
-    with open(fn) as f:
-        in_data = f.read()
 
-    # Extract arguments.
-    match = re.search(ARGS_RE, in_data)
-    args = match.group(1) if match else ''
+    def __init__(self, cmds):
+        self.cmds = cmds
+        self.runs = []
+        self.children = {}
 
-    # Run pipeline.
-    cmds = [
-        c.format(args=args)
-        for c in pipeline
-    ]
-    return run_pipe(cmds, in_data, timeout)
+    def all_runs(self):
+        """Get the names of all the runs that go through this stage.
+        """
+        names = list(self.runs)
+        for child in self.children.values():
+            names += child.all_runs()
+        return names
+
+
+def prefix_tree(pipelines):
+    """Build a prefix tree from a dict mapping run names to lists of
+    commands, so runs whose pipelines start with the same commands share
+    the stages for them. Chains of stages that have only one child and
+    no runs of their own are merged, so every stage is a pipeline to run
+    as a unit.
+
+    Return the root stage, which has no commands.
+    """
+    root = Stage([])
+    for name, cmds in pipelines.items():
+        stage = root
+        for cmd in cmds:
+            stage = stage.children.setdefault(cmd, Stage([cmd]))
+        stage.runs.append(name)
+
+    def merge(stage):
+        for child in stage.children.values():
+            while len(child.children) == 1 and not child.runs:
+                grandchild, = child.children.values()
+                child.cmds += grandchild.cmds
+                child.runs = grandchild.runs
+                child.children = grandchild.children
+            merge(child)
+
+    merge(root)
+    return root
+
+
+class BenchmarkRuns:
+    """Run every pipeline on one benchmark.
+
+    Each pipeline runs `warmup + repeat` times. Every round of these
+    trials finishes before the next starts, and the first `warmup`
+    rounds are thrown away. Unless `share` is false, commands that
+    several pipelines start with run only once per trial, and their
+    output goes to the rest of each pipeline (see `prefix_tree`).
+
+    `runs` maps run names to pipelines. After `start`, `futs` maps run
+    names to futures for the list of the `Trial`s they measured. `cpus`
+    is as in `run_cmds`. If `cache` is a `ResultCache`, reuse the stored
+    result from an earlier identical run, if there is one (`cached`
+    counts these). Once the
+    `stop` event (if any) is set, no more commands start.
+    """
+
+    def __init__(self, pool, fn, runs, timeout, cpus=None, cache=None,
+                 share=True, warmup=0, repeat=1, stop=None):
+        self.pool = pool
+        self.fn = fn
+        self.runs = runs
+        self.timeout = timeout
+        self.cpus = cpus
+        self.cache = cache
+        self.share = share
+        self.warmup = warmup
+        self.repeat = repeat
+        self.stop = stop
+
+        self.futs = {name: futures.Future() for name in runs}
+        self.cached = 0
+        self._trials = {name: [] for name in runs}
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Load the benchmark.
+        with open(self.fn, 'rb') as f:
+            self.in_data = f.read()
+
+        # Extract arguments.
+        match = re.search(ARGS_RE, _text(self.in_data))
+        args = match.group(1) if match else ''
+
+        # Look for cached results.
+        self._keys = {}
+        self._todo = {}
+        for name, pipeline in self.runs.items():
+            cmds = [
+                c.format(args=args)
+                for c in pipeline
+            ]
+            entry = None
+            if self.cache is not None:
+                key = cache_key(self.in_data, cmds, args, self.timeout)
+                self._keys[name] = key
+                entry = self.cache.get(key)
+            if entry is None:
+                self._todo[name] = cmds
+            else:
+                self.cached += 1
+                self.futs[name].set_result([
+                    Trial(entry['stdout'], entry['stderr'], None, None)
+                ])
+
+        # Run the rest.
+        self._round = 0
+        with self._lock:
+            self._next_round()
+
+    def _next_round(self):
+        """Start the next round of trials, or finish the runs if that
+        was the last one. The caller holds the lock.
+        """
+        if self._round == self.warmup + self.repeat or not self._todo:
+            for name in self._todo:
+                self.futs[name].set_result(self._trials[name])
+            return
+
+        self._round += 1
+        self._pending = len(self._todo)
+        if self.share:
+            trees = [prefix_tree(self._todo)]
+        else:
+            trees = [prefix_tree({name: cmds})
+                     for name, cmds in self._todo.items()]
+        for tree in trees:
+            self.pool.submit(self._run_stage, tree, self.in_data, 0.0,
+                             Usage(0.0, 0))
+
+    def _run_stage(self, stage, input, secs, usage):
+        """Run one stage of a prefix tree, then start its children on
+        its output. `secs` and `usage` are the time and resources the
+        stage's ancestors used, and the time counts toward the timeout.
+        """
+        if self.stop is not None and self.stop.is_set():
+            return
+        try:
+            if stage.cmds:
+                timeout = None if self.timeout is None else \
+                    max(0, self.timeout - secs)
+                stdout, stderr, stage_usage, stage_secs = run_cmds(
+                    stage.cmds, input, timeout, self.cpus
+                )
+                secs += stage_secs
+                if usage and stage_usage:
+                    usage = Usage(usage.cpu_time + stage_usage.cpu_time,
+                                  max(usage.max_rss, stage_usage.max_rss))
+                else:
+                    usage = None
+            else:
+                stdout, stderr = input, b''
+        except Exception as exc:
+            for name in stage.all_runs():
+                self._finish(name, exc=exc)
+            return
+
+        for child in stage.children.values():
+            self.pool.submit(self._run_stage, child, stdout, secs, usage)
+        for name in stage.runs:
+            try:
+                trial = Trial(_text(stdout), _text(stderr), usage, secs)
+            except Exception as exc:
+                self._finish(name, exc=exc)
+            else:
+                self._finish(name, trial)
+
+    def _finish(self, name, trial=None, exc=None):
+        """Record the outcome of one trial of a run. A run stops at its
+        first failure (like a timeout).
+        """
+        with self._lock:
+            if exc is not None:
+                del self._todo[name]
+                self.futs[name].set_exception(exc)
+            elif self._round > self.warmup:
+                self._trials[name].append(trial)
+                # Timeouts are not cached: they depend on how busy the
+                # machine was.
+                if self.cache is not None:
+                    self.cache.put(self._keys[name], {
+                        'stdout': trial.stdout,
+                        'stderr': trial.stderr,
+                    })
+
+            self._pending -= 1
+            if not self._pending:
+                self._next_round()
 
 
 def get_result(strings, extract_re):
@@ -75,63 +537,385 @@ def get_result(strings, extract_re):
     return None
 
 
+def t_critical(df):
+    """Get the two-sided 95% critical value of Student's t distribution
+    with `df` degrees of freedom.
+    """
+    if df <= len(T_95):
+        return T_95[df - 1]
+    # Beyond the table, use the first terms of the Cornish-Fisher
+    # expansion around the normal distribution.
+    z = 1.959964
+    return z + (z ** 3 + z) / (4 * df) + \
+        (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+
+def reject_outliers(samples, threshold=3.5):
+    """Drop the samples whose modified z-score, which measures their
+    distance from the median in units of the median absolute deviation
+    (MAD), is more than `threshold`.
+    """
+    median = statistics.median(samples)
+    mad = statistics.median([abs(x - median) for x in samples])
+    if not mad:
+        return list(samples)
+    return [x for x in samples if 0.6745 * abs(x - median) / mad <= threshold]
+
+
+def summarize(samples):
+    """Compute a `Summary` of a list of numbers, with a 95% confidence
+    interval for the mean.
+    """
+    kept = reject_outliers(samples)
+    n = len(kept)
+    mean = statistics.mean(kept)
+    if n > 1:
+        stddev = statistics.stdev(kept)
+        half = t_critical(n - 1) * stddev / math.sqrt(n)
+    else:
+        stddev = half = 0.0
+    return Summary(mean, statistics.median(kept), stddev, min(kept),
+                   mean - half, mean + half, n, len(samples) - n)
+
+
+def format_number(x):
+    """Format a statistic with up to six decimal places.
+    """
+    return '{:.6f}'.format(x).rstrip('0').rstrip('.')
+
+
+def benchmark_records(fn, futs, config, repeat):
+    """Check and summarize the results of the runs on one benchmark.
+
+    `futs` maps run names, in order, to futures for their trials (see
+    `BenchmarkRuns`). The first run's output is the one the others must
+    match. Generate a record for each
+    run: a dict with the benchmark and run names, the `result`, the
+    `Summary` fields (when there are repeated trials), and the `Usage`
+    fields. Missing values are None.
+    """
+    bench, _ = os.path.splitext(os.path.basename(fn))
+    timing = config.get('time', False)
+    first_out = None
+    for name, fut in futs.items():
+        try:
+            trials = fut.result()
+        except subprocess.TimeoutExpired:
+            trials = []
+            status = 'timeout'
+        else:
+            status = None
+
+        # Check correctness.
+        if first_out is None:
+            first_out = trials[0].stdout if trials else ''
+        if any(t.stdout != first_out for t in trials) and not status:
+            status = 'incorrect'
+
+        # Extract the figure of merit from every trial.
+        if timing:
+            results = [format_number(t.secs) for t in trials]
+        else:
+            results = [get_result([t.stdout, t.stderr], config['extract'])
+                       for t in trials]
+        if not all(results) and not status:
+            status = 'missing'
+        summary = None
+        if repeat > 1 and not status:
+            try:
+                summary = summarize([float(r) for r in results])
+            except ValueError:
+                status = 'missing'
+
+        if status:
+            result = status
+        elif summary:
+            result = format_number(summary.median)
+        else:
+            result = results[0]
+        record = {'benchmark': bench, 'run': name, 'result': result}
+        if repeat > 1:
+            record.update(summary._asdict() if summary
+                          else dict.fromkeys(STATS_COLUMNS))
+
+        # Report the median CPU time and the largest RSS of the trials.
+        usages = [t.usage for t in trials]
+        if usages and all(usages):
+            record['cpu_time'] = round(statistics.median(u.cpu_time
+                                                         for u in usages), 6)
+            record['max_rss'] = max(u.max_rss for u in usages)
+        else:
+            record['cpu_time'] = record['max_rss'] = None
+        yield record
+
+
+class CSVOutput:
+    """Write records as rows of a CSV file.
+    """
+
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+        self.writer = csv.writer(f)
+
+    def write_header(self):
+        self.writer.writerow(self.columns)
+
+    def write(self, record):
+        row = []
+        for col in self.columns:
+            val = record[col]
+            if val is None:
+                val = ''
+            elif col == 'cpu_time':
+                val = '{:.3f}'.format(val)
+            elif isinstance(val, float):
+                val = format_number(val)
+            row.append(val)
+        self.writer.writerow(row)
+
+    @staticmethod
+    def parse(text):
+        """Get the header and the (benchmark, run) keys from the text of
+        an existing output file.
+        """
+        rows = list(csv.reader(io.StringIO(text)))
+        if not rows:
+            return None, set()
+        return rows[0], {(row[0], row[1]) for row in rows[1:] if row}
+
+
+class JSONLinesOutput:
+    """Write records as JSON objects, one per line.
+    """
+
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+
+    def write_header(self):
+        pass
+
+    def write(self, record):
+        self.f.write(json.dumps({col: record[col] for col in self.columns}))
+        self.f.write('\n')
+
+    @staticmethod
+    def parse(text):
+        keys = set()
+        for line in text.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                keys.add((record['benchmark'], record['run']))
+        return None, keys
+
+
+OUTPUT_FORMATS = {
+    'csv': CSVOutput,
+    'jsonl': JSONLinesOutput,
+}
+
+
+def read_partial(path, output_cls):
+    """Read an existing (possibly partial) output file to resume from.
+
+    If the last line is incomplete because an earlier invocation was
+    interrupted while writing it, remove it from the file. Return the
+    header (or None) and the set of (benchmark, run) keys present.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None, set()
+
+    end = data.rfind(b'\n') + 1
+    if end < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    return output_cls.parse(data[:end].decode())
+
+
 @click.command()
 @click.option('-j', '--jobs', default=None, type=int,
               help='parallel threads to use (default: suitable for machine)')
+@click.option('--cores', is_flag=True,
+              help='run at most one pipeline per physical core')
+@click.option('--pin', is_flag=True,
+              help='pin every pipeline to its own physical core '
+              '(implies --cores)')
+@click.option('--rusage', is_flag=True,
+              help='report the CPU time and max RSS of every run')
+@click.option('--cache', 'use_cache', is_flag=True,
+              help='reuse the results of identical earlier runs')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              default=default_cache_dir, show_default='~/.cache/brench',
+              help='where to cache results')
+@click.option('--cache-size', type=float, default=256, show_default=True,
+              help='evict the least recently used results to keep the '
+              'cache under this many megabytes')
+@click.option('--clear-cache', is_flag=True,
+              help='delete all cached results first')
+@click.option('--no-share', is_flag=True,
+              help='run every pipeline from the start, instead of sharing '
+              'the output of commands that pipelines start with')
+@click.option('-o', '--output', type=click.Path(dir_okay=False),
+              help='write results to this file (default: standard output)')
+@click.option('--format', 'output_format', default='csv', show_default=True,
+              type=click.Choice(list(OUTPUT_FORMATS)),
+              help='output format: CSV or JSON lines')
+@click.option('--ordered', is_flag=True,
+              help='write the benchmarks in order, instead of as they '
+              'finish')
+@click.option('--resume', is_flag=True,
+              help='add to an existing --output file, skipping the results '
+              'it already has')
 @click.argument('config_path', metavar='CONFIG', type=click.Path(exists=True))
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
-def brench(config_path, files, jobs):
-    """Run a batch of benchmarks and emit a CSV of results.
+def brench(config_path, files, jobs, cores, pin, rusage, use_cache,
+           cache_dir, cache_size, clear_cache, no_share, output,
+           output_format, ordered, resume):
+    """Run a batch of benchmarks and emit a CSV (or JSON lines) of results.
     """
+    if pin and not hasattr(os, 'sched_setaffinity'):
+        raise click.UsageError('--pin is not supported on this platform')
+    if resume and not output:
+        raise click.UsageError('--resume needs an --output file')
+
     with open(config_path) as f:
         config = tomlkit.loads(f.read())
 
     # Use configured file list, if none is specified via the CLI.
     if not files and 'benchmarks' in config:
         files = glob.glob(config['benchmarks'], recursive=True)
+    files = list(dict.fromkeys(files))
 
     timeout = config.get('timeout', 5)
+    warmup = config.get('warmup', 0)
+    repeat = config.get('repeat', 1)
+    timing = config.get('time', False)
+    if repeat < 1 or warmup < 0:
+        raise click.UsageError('repeat must be at least 1, and warmup at '
+                               'least 0')
+
+    # Timed and repeated runs and resource usage are measurements, so
+    # they are not cached.
+    cache = None
+    if clear_cache:
+        ResultCache(cache_dir).clear()
+    if use_cache and not (timing or repeat > 1 or rusage):
+        cache = ResultCache(cache_dir)
+
+    # Avoid oversubscribing the machine: limit the number of pipelines
+    # in flight to the number of physical cores, and optionally give
+    # each one a core of its own.
+    cpus = None
+    if cores or pin:
+        core_sets = physical_cores()
+        jobs = min(jobs, len(core_sets)) if jobs else len(core_sets)
+        if pin:
+            cpus = queue.Queue()
+            for cpu_set in core_sets[:jobs]:
+                cpus.put(cpu_set)
+
+    columns = ['benchmark', 'run', 'result']
+    if repeat > 1:
+        columns += STATS_COLUMNS
+    if rusage:
+        columns += ['cpu_time', 'max_rss']
+    output_cls = OUTPUT_FORMATS[output_format]
+
+    # Find the results we already have.
+    done = set()
+    if resume:
+        header, done = read_partial(output, output_cls)
+        if header is not None and header != columns:
+            raise click.UsageError(
+                '{} has different columns: {}'.format(output,
+                                                      ', '.join(header))
+            )
+        write_header = header is None and not done
+    else:
+        write_header = True
+
+    if output:
+        out_file = open(output, 'a' if resume else 'w', newline='')
+    else:
+        out_file = sys.stdout
+    out = output_cls(out_file, columns)
+    if write_header:
+        out.write_header()
+        out_file.flush()
 
-    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-        # Submit jobs.
+    stop = threading.Event()
+    with contextlib.ExitStack() as stack:
+        if output:
+            stack.enter_context(out_file)
+        pool = stack.enter_context(
+            futures.ThreadPoolExecutor(max_workers=jobs)
+        )
+        # When we are done (or interrupted), let the pipelines that are
+        # running finish, but do not start any more.
+        stack.callback(stop.set)
+
+        # Submit jobs, skipping the runs that are already done (except
+        # the first, if another run needs its output to compare to).
+        all_runs = list(config['runs'])
+        todo = {}
         futs = {}
+        cached = 0
         for fn in files:
-            for name, run in config['runs'].items():
-                futs[(fn, name)] = pool.submit(run_bench, run['pipeline'], fn,
-                                               timeout)
+            bench, _ = os.path.splitext(os.path.basename(fn))
+            missing = [name for name in all_runs
+                       if (bench, name) not in done]
+            if not missing:
+                continue
+            names = [name for name in all_runs
+                     if name in missing or name == all_runs[0]]
+            bench_runs = BenchmarkRuns(
+                pool, fn, {name: config['runs'][name]['pipeline']
+                           for name in names},
+                timeout, cpus, cache, not no_share, warmup, repeat, stop,
+            )
+            bench_runs.start()
+            cached += bench_runs.cached
+            todo[fn] = missing
+            futs[fn] = bench_runs.futs
 
-        # Collect results and print CSV.
-        writer = csv.writer(sys.stdout)
-        writer.writerow(['benchmark', 'run', 'result'])
-        for fn in files:
-            first_out = None
-            for name in config['runs']:
-                try:
-                    stdout, stderr = futs[(fn, name)].result()
-                except subprocess.TimeoutExpired:
-                    stdout, stderr = '', ''
-                    status = 'timeout'
-                else:
-                    status = None
-
-                # Check correctness.
-                if first_out is None:
-                    first_out = stdout
-                elif stdout != first_out and not status:
-                    status = 'incorrect'
-
-                # Extract the figure of merit.
-                result = get_result([stdout, stderr], config['extract'])
-                if not result and not status:
-                    status = 'missing'
-
-                # Report the result.
-                bench, _ = os.path.splitext(os.path.basename(fn))
-                writer.writerow([
-                    bench,
-                    name,
-                    status if status else result,
-                ])
+        def report(fn):
+            for record in benchmark_records(fn, futs[fn], config, repeat):
+                if record['run'] in todo[fn]:
+                    out.write(record)
+            out_file.flush()
+            del futs[fn]  # Free the outputs (see `fut_benches` below).
+
+        # Write each benchmark's results as soon as all its runs finish
+        # (and, with --ordered, all the benchmarks before it).
+        order = [fn for fn in files if fn in futs]
+        finished = set()
+        pending = {fn: len(futs[fn]) for fn in order}
+        fut_benches = {fut: fn for fn in order
+                       for fut in futs[fn].values()}
+        for fut in futures.as_completed(fut_benches):
+            # Forget each future as it finishes, so that `futs` holds
+            # the only reference to it until its benchmark is reported.
+            fn = fut_benches.pop(fut)
+            pending[fn] -= 1
+            if pending[fn]:
+                continue
+            if not ordered:
+                report(fn)
+                continue
+            finished.add(fn)
+            while order and order[0] in finished:
+                report(order.pop(0))
+
+    if cache is not None:
+        cache.evict(cache_size * 1024 * 1024)
+    if cached:
+        print('brench: {} results came from the cache in {} (use '
+              '--clear-cache if something they depend on changed)'.format(
+                  cached, cache_dir), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -117,16 +117,29 @@ class CFG:
 
         colors = [WHITE] * self.n
 
-        def dfs_visit(node):
-            if colors[node] == WHITE:
-                colors[node] = GRAY
-                if pre:
-                    pre(node)
-                for v in edges[node]:
-                    dfs_visit(v)
-                colors[node] = BLACK
-                if post:
-                    post(node)
+        # Iterative, with a stack of (node, iterator over remaining
+        # neighbors), so deep graphs don't hit the recursion limit.
+        def dfs_visit(root):
+            if colors[root] != WHITE:
+                return
+            colors[root] = GRAY
+            if pre:
+                pre(root)
+            stack = [(root, iter(edges[root]))]
+            while stack:
+                node, rest = stack[-1]
+                for v in rest:
+                    if colors[v] == WHITE:
+                        colors[v] = GRAY
+                        if pre:
+                            pre(v)
+                        stack.append((v, iter(edges[v])))
+                        break
+                else:
+                    stack.pop()
+                    colors[node] = BLACK
+                    if post:
+                        post(node)
 
         for i in order:
             dfs_visit(i)
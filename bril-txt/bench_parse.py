@@ -0,0 +1,67 @@
+"""Compare the LALR and Earley Bril parsers.
+
+Parse every benchmark with both parsers, check that they produce
+byte-identical JSON, and report how long each one took. Pass a list of
+`.bril` files to use instead of the benchmark suite.
+"""
+
+import glob
+import os
+import sys
+import time
+
+import briltxt
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'benchmarks', '**', '*.bril')
+
+
+def time_parser(kind, sources):
+    """Parse all the sources with one kind of parser. Return the time it
+    took to construct the parser, the time spent parsing, and the JSON
+    output for every source.
+    """
+    # Parsing an empty program builds the parser (and nothing else).
+    start = time.perf_counter()
+    briltxt.parse_bril_obj('', parser=kind)
+    build_time = time.perf_counter() - start
+
+    outputs = []
+    start = time.perf_counter()
+    for src in sources:
+        outputs.append(briltxt.parse_bril(src, parser=kind))
+    parse_time = time.perf_counter() - start
+
+    return build_time, parse_time, outputs
+
+
+def bench_parse(files):
+    sources = []
+    for fn in files:
+        with open(fn) as f:
+            sources.append(f.read())
+
+    results = {kind: time_parser(kind, sources)
+               for kind in ('earley', 'lalr')}
+
+    print('{} files'.format(len(files)))
+    for kind, (build_time, parse_time, _) in results.items():
+        print('{:>6}: build {:.3f}s, parse {:.3f}s'.format(
+            kind, build_time, parse_time,
+        ))
+    speedup = results['earley'][1] / results['lalr'][1]
+    print('speedup: {:.1f}x'.format(speedup))
+
+    mismatches = [
+        fn for fn, a, b in zip(files, results['earley'][2],
+                               results['lalr'][2])
+        if a != b
+    ]
+    for fn in mismatches:
+        print('mismatch: {}'.format(fn))
+    return not mismatches
+
+
+if __name__ == '__main__':
+    files = sys.argv[1:] or sorted(glob.glob(BENCHMARKS, recursive=True))
+    sys.exit(0 if bench_parse(files) else 1)
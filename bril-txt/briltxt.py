@@ -10,6 +10,9 @@ format and emits the ordinary JSON representation.
 import lark
 import sys
 import json
+import os
+import hashlib
+import struct
 
 __version__ = '0.0.1'
 
@@ -63,6 +66,62 @@ COMMENT: /#.*/
 %ignore COMMENT
 """.strip()
 
+# The same language as `GRAMMAR`, restated so it is LALR(1). This lets us
+# use Lark's much faster LALR parser (with a contextual lexer) instead of
+# Earley. The trees it produces are identical, so the JSON is too. The only
+# structural change is that a parenthesized argument list is a single
+# optional rule, so the placeholder positions in `func` are unambiguous.
+LALR_GRAMMAR = r"""
+start: (struct | func)*
+
+struct: STRUCT IDENT "=" "{" mbr* "}"
+mbr: IDENT ":" type ";"
+
+func: FUNC [arg_list] [tyann] "{" instr* "}"
+arg_list: "(" ")" | "(" arg ("," arg)* ")"
+arg: IDENT ":" type
+?instr: const | vop | eop | label
+
+const: IDENT [tyann] "=" "const" lit ";"
+vop: IDENT [tyann] "=" op ";"
+eop: op ";"
+label: LABEL ":"
+
+op: IDENT (FUNC | LABEL | IDENT)*
+
+?tyann: ":" type
+
+lit: SIGNED_INT  -> int
+  | BOOL         -> bool
+  | SIGNED_FLOAT -> float
+  | "nullptr"    -> nullptr
+  | CHAR         -> char
+
+type: IDENT "<" type ">"  -> paramtype
+    | IDENT               -> primtype
+
+BOOL: "true" | "false"
+STRUCT: "struct"
+CHAR:  /'.'/ | /'\\[0abtnvfr]'/
+IDENT: ("_"|"%"|LETTER) ("_"|"%"|"."|LETTER|DIGIT)*
+FUNC: "@" IDENT
+LABEL: "." IDENT
+COMMENT: /#.*/
+
+
+%import common.SIGNED_INT
+%import common.SIGNED_FLOAT
+%import common.WS
+%import common.LETTER
+%import common.DIGIT
+%ignore WS
+%ignore COMMENT
+""".strip()
+
+# Set this environment variable to a directory to keep the compiled LALR
+# parser on disk between runs.
+CACHE_DIR_VAR = 'BRILTXT_CACHE_DIR'
+
 control_chars = {
     '\\0': 0,
     '\\a': 7,
@@ -117,7 +176,7 @@ class JSONTransformer(lark.Transformer):
         name = items.pop(0)
         typ = items.pop(0)
         return {
-            'name': name,
+            'name': str(name),
             'type': typ,
         }
 
@@ -125,7 +184,7 @@ class JSONTransformer(lark.Transformer):
         name = items[1]
         mbrs = items[2:]
         return {
-            'name': name,
+            'name': str(name),
             'mbrs': mbrs,
         }
 
@@ -133,7 +192,7 @@ class JSONTransformer(lark.Transformer):
         name = items.pop(0)
         typ = items.pop(0)
         return {
-            'name': name,
+            'name': str(name),
             'type': typ,
         }
 
@@ -230,19 +289,84 @@ class JSONTransformer(lark.Transformer):
         return value
 
 
-def parse_bril(txt, include_pos=False):
+# Constructed parsers, by kind and embedded transformer. Building one
+# means compiling the grammar, so we do it at most once per process.
+_parsers = {}
+
+
+def _cache_path():
+    """Get the on-disk location for the compiled LALR parser, or None if
+    caching is disabled. The file name includes a hash of the grammar, so
+    changing the grammar never picks up a stale parser.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_VAR)
+    if not cache_dir:
+        return None
+    digest = hashlib.sha256(LALR_GRAMMAR.encode('utf8')).hexdigest()
+    return os.path.join(cache_dir, 'briltxt-{}.lark'.format(digest[:16]))
+
+
+def get_parser(kind='lalr', include_pos=None):
+    """Get the (lazily constructed) Lark parser of the given kind, which
+    is either `'lalr'` or `'earley'`.
+
+    By default, the parser produces a parse tree. For LALR parsers, set
+    `include_pos` to a bool to instead embed a `JSONTransformer` in the
+    parser, so parsing directly produces the JSON data with no
+    intermediate tree.
+    """
+    key = (kind, include_pos)
+    if key not in _parsers:
+        if kind == 'lalr':
+            cache = _cache_path()
+            transformer = None if include_pos is None \
+                else JSONTransformer(include_pos)
+            _parsers[key] = lark.Lark(
+                LALR_GRAMMAR,
+                parser='lalr',
+                maybe_placeholders=True,
+                cache=cache if cache else False,
+                transformer=transformer,
+            )
+        elif kind == 'earley' and include_pos is None:
+            _parsers[key] = lark.Lark(GRAMMAR, maybe_placeholders=True)
+        else:
+            raise ValueError('unsupported parser {}'.format(key))
+    return _parsers[key]
+
+
+def parse_bril_obj(txt, include_pos=False, parser='lalr'):
+    """Parse a Bril program and return its JSON data as Python objects.
+
+    By default, use the fast LALR parser, which builds the JSON data
+    during parsing. If it rejects the input, fall back to the Earley
+    parser, which also produces the error message for programs that are
+    actually malformed. Use `parser='earley'` to skip the LALR attempt.
+    """
+    if parser == 'lalr':
+        try:
+            return get_parser('lalr', include_pos).parse(txt)
+        except lark.UnexpectedInput:
+            pass
+    tree = get_parser('earley').parse(txt)
+    return JSONTransformer(include_pos).transform(tree)
+
+
+def parse_bril(txt, include_pos=False, parser='lalr'):
     """Parse a Bril program and return a JSON string.
 
-    Optionally include source position information.
+    Optionally include source position information. Use `parser` to pick
+    the parsing algorithm (see `parse_bril_obj`).
     """
-    parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
-    tree = parser.parse(txt)
-    data = JSONTransformer(include_pos).transform(tree)
+    data = parse_bril_obj(txt, include_pos, parser)
     return json.dumps(data, indent=2, sort_keys=True)
 
 
 # Text format pretty-printer.
 
+control_chars_reverse = {y: x for x, y in control_chars.items()}
+
+
 def type_to_str(type):
     if isinstance(type, dict):
         assert len(type) == 1
@@ -254,7 +378,6 @@ def type_to_str(type):
 
 def value_to_str(type, value):
     if not isinstance(type, dict) and type.lower() == "char":
-        control_chars_reverse = {y: x for x, y in control_chars.items()}
         if ord(value) in control_chars_reverse:
             value = control_chars_reverse[ord(value)]
         return "'{}'".format(value)
@@ -295,12 +418,12 @@ def instr_to_string(instr):
             return rhs
 
 
-def print_instr(instr):
-    print('  {};'.format(instr_to_string(instr)))
+def print_instr(instr, file=None):
+    (file or sys.stdout).write('  {};\n'.format(instr_to_string(instr)))
 
 
-def print_label(label):
-    print('.{}:'.format(label['label']))
+def print_label(label, file=None):
+    (file or sys.stdout).write('.{}:\n'.format(label['label']))
 
 
 def args_to_string(args):
@@ -313,24 +436,342 @@ def args_to_string(args):
         return ''
 
 
-def print_func(func):
+def print_func(func, file=None):
+    """Print a function to `file` (by default, standard output).
+    """
+    write = (file or sys.stdout).write
     typ = func.get('type', 'void')
-    print('@{}{}{} {{'.format(
+    write('@{}{}{} {{\n'.format(
         func['name'],
         args_to_string(func.get('args', [])),
         ': {}'.format(type_to_str(typ)) if typ != 'void' else '',
     ))
     for instr_or_label in func['instrs']:
         if 'label' in instr_or_label:
-            print_label(instr_or_label)
+            write('.{}:\n'.format(instr_or_label['label']))
         else:
-            print_instr(instr_or_label)
-    print('}')
+            write('  {};\n'.format(instr_to_string(instr_or_label)))
+    write('}\n')
 
 
-def print_prog(prog):
+def print_prog(prog, file=None):
     for func in prog['functions']:
-        print_func(func)
+        print_func(func, file)
+
+
+# Incremental JSON input.
+
+class JSONStream:
+    """Decode JSON values one at a time from a text stream, reading only
+    as much of the stream as it takes to decode the next value.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size):
+        """Append up to `size` more characters to the buffer, discarding
+        everything that has already been consumed.
+        """
+        data = self.stream.read(size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """Skip whitespace and return the next character (or an empty
+        string at the end of the stream).
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._read(self.chunk_size)
+
+    def expect(self, char):
+        """Consume the next non-whitespace character, which must be
+        `char`.
+        """
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(
+                'Expecting {!r}'.format(char), self.buf, self.pos,
+            )
+        self.pos += 1
+
+    def value(self):
+        """Decode and consume the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A value that runs to the end of the buffer (a number,
+                # say) might continue in the unread part of the stream.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return val
+
+            # Read more, growing geometrically so large values do not
+            # get decoded over and over.
+            self._read(max(self.chunk_size, len(self.buf)))
+
+
+def iter_functions(stream):
+    """Generate the functions in a JSON Bril program one at a time as
+    they are read from a text stream. Other top-level keys are decoded
+    and discarded.
+    """
+    reader = JSONStream(stream)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'functions':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() != ',':
+                        reader.expect(']')
+                        break
+                    reader.pos += 1
+        else:
+            reader.value()
+
+        if reader.peek() != ',':
+            reader.expect('}')
+            return
+        reader.pos += 1
+
+
+def print_prog_stream(stream, file=None):
+    """Pretty-print a JSON Bril program from a text stream, one function
+    at a time, so the whole program is never in memory at once.
+    """
+    for func in iter_functions(stream):
+        print_func(func, file)
+
+
+# Binary format.
+#
+# A compact encoding of the same data as the JSON representation, for
+# passing programs between tools without formatting and parsing text. A
+# file consists of:
+#
+# - The magic bytes `BIN_MAGIC` and a version byte.
+# - A string table: a count followed by length-prefixed UTF-8 strings.
+# - The program itself, as a single tagged value.
+#
+# Values are a tag byte followed by a payload. Integers and lengths are
+# unsigned LEB128 varints. Strings (including dictionary keys) are
+# interned: they are encoded as indices, where the indices below
+# `len(BIN_STRINGS)` refer to that fixed table of common keys, opcodes,
+# and types, and the rest refer to the file's own string table.
+
+BIN_MAGIC = b'BRLB'
+BIN_VERSION = 1
+
+# Append-only: changing the position of any of these strings changes the
+# meaning of existing files.
+BIN_STRINGS = (
+    # Keys.
+    'functions', 'structs', 'name', 'args', 'type', 'instrs', 'op', 'dest',
+    'labels', 'funcs', 'value', 'label', 'mbrs', 'pos', 'row', 'col',
+    # Types.
+    'int', 'bool', 'float', 'char', 'ptr',
+    # Opcodes.
+    'const', 'id', 'add', 'mul', 'sub', 'div', 'eq', 'lt', 'gt', 'le', 'ge',
+    'not', 'and', 'or', 'jmp', 'br', 'call', 'ret', 'print', 'nop', 'phi',
+    'alloc', 'free', 'store', 'load', 'ptradd',
+    'fadd', 'fmul', 'fsub', 'fdiv', 'feq', 'flt', 'fle', 'fgt', 'fge',
+    'speculate', 'commit', 'guard',
+    'ceq', 'clt', 'cle', 'cgt', 'cge', 'char2int', 'int2char',
+)
+
+# Value tags.
+(BIN_NULL, BIN_FALSE, BIN_TRUE, BIN_INT, BIN_NEG_INT, BIN_FLOAT, BIN_STR,
+ BIN_LIST, BIN_DICT) = range(9)
+
+_float = struct.Struct('<d')
+
+
+def _write_varint(buf, n):
+    """Append a non-negative integer to a bytearray as a varint.
+    """
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def dumps_bin(prog):
+    """Encode a Bril program (or any JSON-compatible data) in the binary
+    format and return the bytes.
+    """
+    strings = {s: i for i, s in enumerate(BIN_STRINGS)}
+    body = bytearray()
+    append = body.append
+
+    def intern(s):
+        idx = strings.get(s)
+        if idx is None:
+            idx = strings[s] = len(strings)
+        _write_varint(body, idx)
+
+    def value(val):
+        typ = type(val)
+        if typ is str:
+            append(BIN_STR)
+            intern(val)
+        elif typ is dict:
+            append(BIN_DICT)
+            _write_varint(body, len(val))
+            for k, v in val.items():
+                intern(k)
+                value(v)
+        elif typ is list:
+            append(BIN_LIST)
+            _write_varint(body, len(val))
+            for v in val:
+                value(v)
+        elif typ is bool:
+            append(BIN_TRUE if val else BIN_FALSE)
+        elif typ is int:
+            if val >= 0:
+                append(BIN_INT)
+                _write_varint(body, val)
+            else:
+                append(BIN_NEG_INT)
+                _write_varint(body, -val)
+        elif typ is float:
+            append(BIN_FLOAT)
+            body.extend(_float.pack(val))
+        elif val is None:
+            append(BIN_NULL)
+        elif isinstance(val, str):
+            value(str(val))
+        else:
+            raise TypeError('cannot encode {!r}'.format(val))
+
+    value(prog)
+
+    # The header and string table go in front of the body.
+    out = bytearray(BIN_MAGIC)
+    out.append(BIN_VERSION)
+    extra = list(strings)[len(BIN_STRINGS):]
+    _write_varint(out, len(extra))
+    for s in extra:
+        data = s.encode('utf8')
+        _write_varint(out, len(data))
+        out.extend(data)
+    out.extend(body)
+    return bytes(out)
+
+
+def loads_bin(data):
+    """Decode a program from bytes in the binary format.
+    """
+    if not data:
+        raise ValueError('empty input: expected a binary Bril file')
+    if data[:len(BIN_MAGIC)] != BIN_MAGIC:
+        raise ValueError('not a binary Bril file')
+    if len(data) == len(BIN_MAGIC):
+        raise ValueError('truncated binary Bril file')
+    if data[len(BIN_MAGIC)] != BIN_VERSION:
+        raise ValueError('unsupported binary Bril version {}'.format(
+            data[len(BIN_MAGIC)]
+        ))
+    pos = len(BIN_MAGIC) + 1
+
+    def varint():
+        nonlocal pos
+        byte = data[pos]
+        pos += 1
+        if byte < 0x80:
+            return byte
+        n = byte & 0x7f
+        shift = 7
+        while True:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    strings = list(BIN_STRINGS)
+
+    def value():
+        nonlocal pos
+        tag = data[pos]
+        pos += 1
+        if tag == BIN_STR:
+            return strings[varint()]
+        elif tag == BIN_DICT:
+            out = {}
+            for _ in range(varint()):
+                key = strings[varint()]
+                out[key] = value()
+            return out
+        elif tag == BIN_LIST:
+            return [value() for _ in range(varint())]
+        elif tag == BIN_INT:
+            return varint()
+        elif tag == BIN_NEG_INT:
+            return -varint()
+        elif tag == BIN_TRUE:
+            return True
+        elif tag == BIN_FALSE:
+            return False
+        elif tag == BIN_FLOAT:
+            val, = _float.unpack_from(data, pos)
+            pos += _float.size
+            return val
+        elif tag == BIN_NULL:
+            return None
+        else:
+            raise ValueError('unknown tag {} at offset {}'.format(
+                tag, pos - 1
+            ))
+
+    try:
+        for _ in range(varint()):
+            length = varint()
+            if pos + length > len(data):
+                raise IndexError(pos)
+            strings.append(data[pos:pos + length].decode('utf8'))
+            pos += length
+        return value()
+    except (IndexError, struct.error):
+        raise ValueError('truncated binary Bril file') from None
+
+
+def dump_bin(prog, file):
+    """Write a program in the binary format to a binary file.
+    """
+    file.write(dumps_bin(prog))
+
+
+def load_bin(file):
+    """Read a program in the binary format from a binary file.
+    """
+    return loads_bin(file.read())
 
 
 # Command-line entry points.
@@ -340,4 +781,12 @@ def bril2json():
 
 
 def bril2txt():
-    print_prog(json.load(sys.stdin))
+    print_prog_stream(sys.stdin)
+
+
+def bril2bin():
+    dump_bin(json.load(sys.stdin), sys.stdout.buffer)
+
+
+def bin2bril():
+    print(json.dumps(load_bin(sys.stdin.buffer), indent=2, sort_keys=True))
@@ -0,0 +1,148 @@
+"""Cached analyses of Bril functions.
+
+Passes that need a function's CFG, dominators, liveness, and so on can
+get them from a `FunctionAnalyses` instead of rebuilding them. Results
+are computed on demand and kept until a pass reports that it changed the
+function, so a sequence of passes (as in `bril_opt.py`) only recomputes
+what the earlier passes actually invalidated.
+"""
+from collections import defaultdict
+
+from cfg import block_map, add_entry, add_terminators, reassemble, CompactCFG
+from df import df_worklist, ANALYSES as DF_ANALYSES
+from dom import compact_idom, get_dom, dom_tree, dom_fronts
+from form_blocks import form_blocks
+
+# The analyses a `FunctionAnalyses` can compute, by name. Each is a
+# function that takes the `FunctionAnalyses` (so it can ask for other
+# analyses) and returns the result. `CFG_ANALYSES` holds the names of the
+# ones that only depend on the shape of the CFG, not on the instructions
+# inside the blocks.
+ANALYSES = {}
+CFG_ANALYSES = set()
+
+
+def analysis(name, cfg=False):
+    """Decorator to register a new analysis under `name`. Set `cfg` if
+    the result depends only on the control flow graph.
+    """
+    def register(func):
+        ANALYSES[name] = func
+        if cfg:
+            CFG_ANALYSES.add(name)
+        return func
+    return register
+
+
+class FunctionAnalyses:
+    """Lazily computed analysis results for a single function.
+
+    Look up an analysis with `analyses[name]`. The `blocks` analysis is
+    the function's CFG, as an ordered block map with a unique entry block
+    and explicit terminators. Passes may modify those blocks in place and
+    then call `changed` to write them back to the function. If something
+    else replaces the function's instructions, everything is recomputed.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self._results = {}
+        self._instrs = func['instrs']
+
+    def __getitem__(self, name):
+        if self.func['instrs'] is not self._instrs:
+            # The instructions were replaced behind our back.
+            self.invalidate()
+        if name not in self._results:
+            self._results[name] = ANALYSES[name](self)
+        return self._results[name]
+
+    def invalidate(self):
+        """Forget everything, including the CFG. Use this after modifying
+        the function's instructions directly.
+        """
+        self._results.clear()
+        self._instrs = self.func['instrs']
+
+    def changed(self, cfg=True):
+        """Record that a pass modified the blocks in `self['blocks']`:
+        reassemble the function's instructions from them and forget the
+        results that may no longer hold. If `cfg` is False, the pass
+        promises that it did not change the control flow (only
+        non-terminator instructions), so CFG analyses are kept.
+        """
+        blocks = self._results['blocks']
+        self.func['instrs'] = self._instrs = reassemble(blocks)
+        keep = {'blocks'} if cfg else CFG_ANALYSES
+        for name in list(self._results):
+            if name not in keep:
+                del self._results[name]
+
+
+@analysis('blocks', cfg=True)
+def _blocks(analyses):
+    blocks = block_map(form_blocks(analyses.func['instrs']))
+    add_entry(blocks)
+    add_terminators(blocks)
+    return blocks
+
+
+@analysis('entry', cfg=True)
+def _entry(analyses):
+    return next(iter(analyses['blocks']))
+
+
+@analysis('compact_cfg', cfg=True)
+def _compact_cfg(analyses):
+    """The CFG with integer block IDs (see `CompactCFG`)."""
+    return CompactCFG.from_block_map(analyses['blocks'])
+
+
+@analysis('edges', cfg=True)
+def _edges(analyses):
+    """Predecessor and successor maps."""
+    return analyses['compact_cfg'].edges()
+
+
+@analysis('idom', cfg=True)
+def _idom(analyses):
+    graph = analyses['compact_cfg']
+    return {name: graph.names[d] if d >= 0 else None
+            for name, d in zip(graph.names, compact_idom(graph))}
+
+
+@analysis('dom', cfg=True)
+def _dom(analyses):
+    return get_dom(analyses['edges'][1], analyses['entry'], analyses['idom'])
+
+
+@analysis('dom_tree', cfg=True)
+def _dom_tree(analyses):
+    return dom_tree(analyses['idom'])
+
+
+@analysis('dom_fronts', cfg=True)
+def _dom_fronts(analyses):
+    return dom_fronts(analyses['idom'], analyses['edges'][1])
+
+
+@analysis('live')
+def _live(analyses):
+    """The live variables at the start and end of every block."""
+    return df_worklist(analyses['blocks'], DF_ANALYSES['live'])
+
+
+@analysis('def_use')
+def _def_use(analyses):
+    """Maps from variables to the places they are defined and used, as
+    lists of (block name, instruction) pairs.
+    """
+    defs = defaultdict(list)
+    uses = defaultdict(list)
+    for name, block in analyses['blocks'].items():
+        for instr in block:
+            if 'dest' in instr:
+                defs[instr['dest']].append((name, instr))
+            for var in instr.get('args', []):
+                uses[var].append((name, instr))
+    return defs, uses
@@ -0,0 +1,114 @@
+"""Measure how much work the data flow solver in `df.py` does to reach
+a fixed point, compared to a plain FIFO worklist.
+
+For every function in the benchmark suite (or the `.bril` files given on
+the command line) and every analysis, run both solvers, check that they
+agree, and report the total number of transfer function applications
+and the time taken. For the analyses that have a bit-vector version,
+also time that against the set-based one.
+"""
+
+import glob
+import os
+import sys
+import time
+
+import briltxt
+import cfg
+from df import ANALYSES, BIT_ANALYSES, VarBits, df_worklist
+from form_blocks import form_blocks
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'benchmarks', '**', '*.bril')
+
+
+def fifo_worklist(blocks, analysis, stats):
+    """The original solver: a FIFO list that may contain duplicates.
+    """
+    preds, succs = cfg.edges(blocks)
+    if analysis.forward:
+        first_block = list(blocks.keys())[0]
+        in_edges, out_edges = preds, succs
+    else:
+        first_block = list(blocks.keys())[-1]
+        in_edges, out_edges = succs, preds
+
+    in_ = {first_block: analysis.init}
+    out = {node: analysis.init for node in blocks}
+    worklist = list(blocks.keys())
+    while worklist:
+        node = worklist.pop(0)
+        inval = analysis.merge(out[n] for n in in_edges[node])
+        in_[node] = inval
+        outval = analysis.transfer(blocks[node], inval)
+        stats['transfers'] = stats.get('transfers', 0) + 1
+        if outval != out[node]:
+            out[node] = outval
+            worklist += out_edges[node]
+
+    if analysis.forward:
+        return in_, out
+    else:
+        return out, in_
+
+
+SOLVERS = {
+    'fifo': fifo_worklist,
+    'rpo': df_worklist,
+}
+
+
+def load_cfgs(files):
+    cfgs = []
+    for fn in files:
+        with open(fn) as f:
+            bril = briltxt.parse_bril_obj(f.read())
+        for func in bril['functions']:
+            blocks = cfg.block_map(form_blocks(func['instrs']))
+            cfg.add_terminators(blocks)
+            cfgs.append(blocks)
+    return cfgs
+
+
+def bench_df(files):
+    cfgs = load_cfgs(files)
+    print('{} functions in {} files'.format(len(cfgs), len(files)))
+
+    ok = True
+    for name, analysis in ANALYSES.items():
+        results = {}
+        for solver_name, solver in SOLVERS.items():
+            stats = {}
+            start = time.perf_counter()
+            results[solver_name] = [solver(blocks, analysis, stats)
+                                    for blocks in cfgs]
+            elapsed = time.perf_counter() - start
+            print('{:>8} {:>5}: {:7} transfers, {:.3f}s'.format(
+                name, solver_name, stats.get('transfers', 0), elapsed,
+            ))
+        if results['fifo'] != results['rpo']:
+            print('{}: solvers disagree'.format(name))
+            ok = False
+
+        if name in BIT_ANALYSES:
+            start = time.perf_counter()
+            bit_results = []
+            for blocks in cfgs:
+                table = VarBits()
+                in_, out = df_worklist(blocks,
+                                       BIT_ANALYSES[name](blocks, table))
+                bit_results.append((
+                    {b: table.decode(v) for b, v in in_.items()},
+                    {b: table.decode(v) for b, v in out.items()},
+                ))
+            elapsed = time.perf_counter() - start
+            print('{:>8} {:>5}: {:.3f}s'.format(name, 'bits', elapsed))
+            if bit_results != results['rpo']:
+                print('{}: bit vectors disagree'.format(name))
+                ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    files = sys.argv[1:] or sorted(glob.glob(BENCHMARKS, recursive=True))
+    sys.exit(0 if bench_df(files) else 1)
@@ -0,0 +1,121 @@
+"""Measure how dominator computation in `dom.py` scales on large
+synthetic control flow graphs, compared to the original set-based
+algorithm.
+
+The synthetic CFGs are a chain of blocks with random forward branches
+and loop back edges. The set-based algorithm needs quadratic memory, so
+by default it only runs on the smaller graphs.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from dom import map_inv, postorder, get_idom, dom_tree, dom_fronts
+
+
+def synthetic_cfg(n, rng):
+    """Generate a successor map for a random CFG with `n` blocks. Block
+    0 is the entry and has no predecessors.
+    """
+    succ = {}
+    for i in range(n - 1):
+        targets = [i + 1]
+        roll = rng.random()
+        if roll < 0.2:
+            targets.append(rng.randint(i + 1, min(n - 1, i + 50)))
+        elif roll < 0.3 and i > 0:
+            targets.append(rng.randint(max(1, i - 50), i))
+        succ['b{}'.format(i)] = ['b{}'.format(t) for t in targets]
+    succ['b{}'.format(n - 1)] = []
+    return succ
+
+
+def set_dom(succ, entry):
+    """The original algorithm: iterate set intersections to a fixed point.
+    """
+    pred = map_inv(succ)
+    nodes = list(reversed(postorder(succ, entry)))
+    dom = {v: set(nodes) for v in succ}
+    changed = True
+    while changed:
+        changed = False
+        for node in nodes:
+            preds = [dom[p] for p in pred[node]]
+            new_dom = set.intersection(*preds) if preds else set()
+            new_dom.add(node)
+            if dom[node] != new_dom:
+                dom[node] = new_dom
+                changed = True
+    return dom
+
+
+def set_dom_tree(dom):
+    dom_inv = map_inv(dom)
+    dom_inv_strict = {a: {b for b in bs if b != a}
+                      for a, bs in dom_inv.items()}
+    dom_inv_strict_2x = {a: set().union(*(dom_inv_strict[b] for b in bs))
+                         for a, bs in dom_inv_strict.items()}
+    return {
+        a: {b for b in bs if b not in dom_inv_strict_2x[a]}
+        for a, bs in dom_inv_strict.items()
+    }
+
+
+def set_dom_fronts(dom, succ):
+    dom_inv = map_inv(dom)
+    frontiers = {}
+    for block in dom:
+        dominated_succs = set()
+        for dominated in dom_inv[block]:
+            dominated_succs.update(succ[dominated])
+        frontiers[block] = {b for b in dominated_succs
+                            if b not in dom_inv[block] or b == block}
+    return frontiers
+
+
+def run_idom(succ):
+    idom = get_idom(succ, 'b0')
+    return dom_tree(idom), dom_fronts(idom, succ)
+
+
+def run_sets(succ):
+    dom = set_dom(succ, 'b0')
+    return set_dom_tree(dom), set_dom_fronts(dom, succ)
+
+
+def bench_dom(sizes, old_max, seed):
+    ok = True
+    for n in sizes:
+        succ = synthetic_cfg(n, random.Random(seed))
+
+        start = time.perf_counter()
+        tree, fronts = run_idom(succ)
+        new_time = time.perf_counter() - start
+        line = '{:>6} blocks: idom {:.3f}s'.format(n, new_time)
+
+        if n <= old_max:
+            start = time.perf_counter()
+            old_tree, old_fronts = run_sets(succ)
+            old_time = time.perf_counter() - start
+            line += ', sets {:.3f}s ({:.1f}x)'.format(
+                old_time, old_time / new_time,
+            )
+            fronts = {k: set(v) for k, v in fronts.items()}
+            if tree != old_tree or fronts != old_fronts:
+                line += ' MISMATCH'
+                ok = False
+        print(line)
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int,
+                        default=[500, 1000, 2000, 5000, 10000])
+    parser.add_argument('--old-max', type=int, default=2000,
+                        help='largest CFG to run the set-based algorithm on')
+    parser.add_argument('--seed', type=int, default=0)
+    opts = parser.parse_args()
+    sys.exit(0 if bench_dom(opts.sizes, opts.old_max, opts.seed) else 1)
@@ -0,0 +1,67 @@
+"""Measure how local value numbering in `lvn.py` scales on large
+synthetic straight-line blocks.
+
+The synthetic blocks look like unrolled code: a fixed pool of variables
+that are repeatedly reassigned with constants, copies, and arithmetic on
+each other, with plenty of redundant computations. With constant-time
+clobbering, the time per instruction should stay flat as blocks grow.
+"""
+
+import argparse
+import copy
+import random
+import time
+
+from lvn import lvn_block, _lookup, _canonicalize, _fold
+
+
+def synthetic_block(n, nvars, rng):
+    """Generate a straight-line block of `n` instructions over a pool of
+    `nvars` integer variables. The variables start out as inputs to the
+    block (like function arguments), so most values are not constants.
+    """
+    names = ['v{}'.format(i) for i in range(nvars)]
+    block = []
+    while len(block) < n:
+        dest = rng.choice(names)
+        roll = rng.random()
+        if roll < 0.1:
+            instr = {'op': 'const', 'value': rng.randint(0, 9)}
+        elif roll < 0.3:
+            instr = {'op': 'id', 'args': [rng.choice(names)]}
+        else:
+            instr = {'op': rng.choice(['add', 'mul', 'sub']),
+                     'args': [rng.choice(names), rng.choice(names)]}
+        instr.update({'dest': dest, 'type': 'int'})
+        block.append(instr)
+    block.append({'op': 'print', 'args': names})
+    return block
+
+
+def bench_lvn(sizes, nvars, seed):
+    base = None
+    for n in sizes:
+        block = synthetic_block(n, nvars, random.Random(seed))
+        work = copy.deepcopy(block)
+
+        start = time.perf_counter()
+        lvn_block(work, _lookup, _canonicalize, _fold)
+        secs = time.perf_counter() - start
+
+        per_instr = secs / len(block) * 1e6
+        if base is None:
+            base = per_instr
+        print('{:>7} instrs: {:.3f}s, {:.2f} us/instr ({:.2f}x)'.format(
+            len(block), secs, per_instr, per_instr / base,
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--vars', type=int, default=64,
+                        help='number of distinct variables in the block')
+    parser.add_argument('--seed', type=int, default=0)
+    opts = parser.parse_args()
+    bench_lvn(opts.sizes, opts.vars, opts.seed)
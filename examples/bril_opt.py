@@ -0,0 +1,171 @@
+"""Run a sequence of optimization passes on a Bril program in a single
+process.
+
+This is equivalent to piping the program through the individual pass
+scripts, but it avoids starting an interpreter and round-tripping the
+program through JSON at every stage. For example, this:
+
+    python bril_opt.py --passes 'to_ssa,lvn -p -c -f,tdce+,from_ssa'
+
+does the same thing as this:
+
+    python to_ssa.py | python lvn.py -p -c -f | python tdce.py tdce+ |
+        python from_ssa.py
+
+Each pass in the comma-separated list is a pass name followed by the
+same arguments the standalone script accepts. All the passes work on one
+function at a time, so with `--jobs`, each worker process runs the whole
+sequence on its share of the functions.
+
+The passes share a `FunctionAnalyses` (see `analysis.py`) for each
+function, so analyses like the CFG and dominator tree are only recomputed
+when an earlier pass changed something they depend on.
+"""
+import argparse
+import shlex
+import sys
+import time
+from functools import partial
+
+from analysis import FunctionAnalyses
+from lvn import lvn_func
+from gvn import gvn_func
+from sccp import func_sccp
+from tdce import MODES as TDCE_MODES
+from to_ssa import func_to_ssa
+from from_ssa import func_from_ssa
+from to_float import ints_to_floats_in_function
+from util import load, dump, map_functions, BIN_FLAG
+
+
+def unmanaged(func_pass):
+    """Wrap a pass that does not use `FunctionAnalyses`. It may change
+    the function in any way, so forget all the analyses after it runs.
+    """
+    def run(func, args, analyses):
+        func_pass(func, args)
+        analyses.invalidate()
+    return run
+
+
+# Every pass takes a function (which it modifies in place), a list of
+# command-line-style arguments, and the function's `FunctionAnalyses`.
+PASSES = {
+    'lvn': unmanaged(lambda func, args: lvn_func(
+        func, '-p' in args, '-c' in args, '-f' in args,
+    )),
+    'gvn': lambda func, args, analyses: gvn_func(
+        func, '-p' in args, '-c' in args, '-f' in args, analyses=analyses,
+    ),
+    'sccp': lambda func, args, analyses: func_sccp(func, analyses),
+    'tdce': unmanaged(lambda func, args: TDCE_MODES[
+        args[0] if args else 'tdce'
+    ](func)),
+    'to_ssa': lambda func, args, analyses: func_to_ssa(
+        func, args[0] if args else 'minimal', analyses,
+    ),
+    'from_ssa': lambda func, args, analyses: func_from_ssa(
+        func, args[0] if args else 'naive', analyses,
+    ),
+    'to_float': unmanaged(
+        lambda func, args: ints_to_floats_in_function(func)
+    ),
+}
+
+# The `tdce` modes are also available as passes of their own.
+for _mode in TDCE_MODES:
+    PASSES[_mode] = unmanaged(
+        lambda func, args, mode=_mode: TDCE_MODES[mode](func)
+    )
+
+
+def parse_passes(spec):
+    """Parse a comma-separated pass list into a list of (name, args)
+    pairs.
+    """
+    out = []
+    for item in spec.split(','):
+        words = shlex.split(item)
+        if not words:
+            continue
+        name, args = words[0], words[1:]
+        if name not in PASSES:
+            raise ValueError('unknown pass {}'.format(name))
+        out.append((name, args))
+    return out
+
+
+def run_passes(bril, passes, timings=None):
+    """Run a list of (name, args) passes on a program in order. If
+    `timings` is a list, append a (name, seconds) pair for each pass,
+    totaled over all the functions.
+    """
+    secs = [0.0] * len(passes)
+    for func in bril['functions']:
+        run_passes_func(passes, func, secs)
+    if timings is not None:
+        for (name, args), t in zip(passes, secs):
+            timings.append((' '.join([name] + args), t))
+    return bril
+
+
+def run_passes_func(passes, func, secs=None):
+    """Run a list of passes on a single function in place. If `secs` is
+    a list, add the time each pass takes to the corresponding entry.
+    """
+    analyses = FunctionAnalyses(func)
+    for i, (name, args) in enumerate(passes):
+        start = time.perf_counter()
+        PASSES[name](func, args, analyses)
+        if secs is not None:
+            secs[i] += time.perf_counter() - start
+
+
+def print_timings(timings, file=sys.stderr):
+    width = max(len(name) for name, _ in timings)
+    for name, secs in timings:
+        print('{:<{}}  {:9.3f} ms'.format(name, width, secs * 1000),
+              file=file)
+    print('{:<{}}  {:9.3f} ms'.format(
+        'total', width, sum(secs for _, secs in timings) * 1000,
+    ), file=file)
+
+
+def bril_opt():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-p', '--passes', required=True,
+                        help='comma-separated list of passes to run')
+    parser.add_argument('-t', '--time', action='store_true',
+                        help='print per-pass timing to stderr')
+    parser.add_argument(BIN_FLAG, action='store_true',
+                        help='emit the binary format instead of JSON')
+    parser.add_argument('-j', '--jobs', type=int, nargs='?', default=1,
+                        const=None,
+                        help='optimize functions in parallel using this '
+                        'many processes (default: one per CPU)')
+    opts = parser.parse_args()
+
+    try:
+        passes = parse_passes(opts.passes)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    timings = []
+    bril = load()
+    if opts.jobs == 1:
+        run_passes(bril, passes, timings)
+    else:
+        # Per-pass times are not meaningful across processes, so just
+        # measure the whole parallel run.
+        start = time.perf_counter()
+        map_functions(partial(run_passes_func, passes), bril, opts.jobs)
+        timings.append(('(all passes, parallel)',
+                        time.perf_counter() - start))
+    dump(bril)
+
+    if opts.time and timings:
+        print_timings(timings)
+
+
+if __name__ == '__main__':
+    bril_opt()
@@ -1,4 +1,6 @@
+from array import array
 from collections import OrderedDict
+from itertools import accumulate, chain
 from util import fresh, flatten
 from form_blocks import TERMINATORS
 
@@ -49,20 +51,21 @@ def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
+    names = list(blocks.keys())
     for i, block in enumerate(blocks.values()):
         if not block:
             if i == len(blocks) - 1:
                 # In the last block, return.
                 block.append({'op': 'ret', 'args': []})
             else:
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({'op': 'jmp', 'labels': [dest]})
         elif block[-1]['op'] not in TERMINATORS:
             if i == len(blocks) - 1:
                 block.append({'op': 'ret', 'args': []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({'op': 'jmp', 'labels': [dest]})
 
 
@@ -102,6 +105,97 @@ def edges(blocks):
     return preds, succs
 
 
+def _csr(lists):
+    """Pack a list of lists of integers into a compressed sparse row
+    layout: a flat array of all the values, and an array of offsets
+    where the values for list `i` are `values[start[i]:start[i + 1]]`.
+    """
+    start = array('l', accumulate(map(len, lists), initial=0))
+    values = array('l', chain.from_iterable(lists))
+    return start, values
+
+
+class CompactCFG:
+    """A control flow graph where blocks are numbered 0 to n - 1, in
+    block map order, instead of looked up by name.
+
+    Edges are stored in compressed sparse row form: the successors of
+    block `i` are `succ[succ_start[i]:succ_start[i + 1]]`, and likewise
+    for predecessors. Use `names` and `ids` to translate between block
+    IDs and names. `blocks` holds the instruction lists (shared with the
+    block map the CFG was built from), or None for a CFG built from an
+    edge map alone.
+
+    The edge arrays are compact, but every element access creates a new
+    Python integer, so loops that touch edges many times should convert
+    them with `tolist()` first.
+    """
+    __slots__ = ('names', 'ids', 'blocks',
+                 'succ_start', 'succ', 'pred_start', 'pred')
+
+    def __init__(self, names, succ_ids, blocks=None):
+        """Build a CFG from a list of block names and, for each block, a
+        list of its successors' IDs.
+        """
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.blocks = blocks
+
+        pred_ids = [[] for _ in self.names]
+        for i, ss in enumerate(succ_ids):
+            for s in ss:
+                pred_ids[s].append(i)
+        self.succ_start, self.succ = _csr(succ_ids)
+        self.pred_start, self.pred = _csr(pred_ids)
+
+    @classmethod
+    def from_block_map(cls, blocks):
+        """Build a CFG from a block map whose blocks all have
+        terminators.
+        """
+        ids = {name: i for i, name in enumerate(blocks)}
+        return cls(
+            blocks.keys(),
+            [[ids[s] for s in successors(block[-1])]
+             for block in blocks.values()],
+            list(blocks.values()),
+        )
+
+    @classmethod
+    def from_succ(cls, succ):
+        """Build a CFG (without instructions) from a successor map, like
+        the second map from `edges`.
+        """
+        ids = {name: i for i, name in enumerate(succ)}
+        return cls(succ, [[ids[s] for s in ss] for ss in succ.values()])
+
+    def __len__(self):
+        return len(self.names)
+
+    def successors(self, i):
+        return self.succ[self.succ_start[i]:self.succ_start[i + 1]]
+
+    def predecessors(self, i):
+        return self.pred[self.pred_start[i]:self.pred_start[i + 1]]
+
+    def edges(self):
+        """Produce name-keyed predecessor and successor maps, as `edges`
+        does.
+        """
+        names = self.names
+        preds = {n: [names[p] for p in self.predecessors(i)]
+                 for i, n in enumerate(names)}
+        succs = {n: [names[s] for s in self.successors(i)]
+                 for i, n in enumerate(names)}
+        return preds, succs
+
+    def to_block_map(self):
+        """Produce a block map of the CFG's blocks. The instruction lists
+        are shared, not copied.
+        """
+        return OrderedDict(zip(self.names, self.blocks))
+
+
 def reassemble(blocks):
     """Flatten a CFG into an instruction list."""
     # This could optimize slightly by opportunistically eliminating
@@ -1,9 +1,11 @@
+import heapq
 import sys
-import json
 from collections import namedtuple
 
 from form_blocks import form_blocks
+from dom import compact_postorder
 import cfg
+from util import load
 
 # A single dataflow analysis consists of these part:
 # - forward: True for forward, False for backward.
@@ -20,39 +22,77 @@ def union(sets):
     return out
 
 
-def df_worklist(blocks, analysis):
+def df_worklist(blocks, analysis, stats=None):
     """The worklist algorithm for iterating a data flow analysis to a
     fixed point.
+
+    The worklist is a priority queue without duplicates. Blocks come out
+    in reverse postorder for forward analyses and postorder for backward
+    ones, so a block's inputs are usually up to date by the time we get
+    to it. If `stats` is a dict, record the number of transfer function
+    applications (`transfers`) and worklist insertions (`pushes`) in it.
     """
-    preds, succs = cfg.edges(blocks)
+    # Work on block IDs in a compact CFG rather than on names.
+    graph = cfg.CompactCFG.from_block_map(blocks)
+    n = len(graph)
+
+    # Reverse postorder, followed by any unreachable blocks.
+    order = compact_postorder(graph)
+    order.reverse()
+    reached = bytearray(n)
+    for node in order:
+        reached[node] = 1
+    order += [node for node in range(n) if not reached[node]]
 
     # Switch between directions.
     if analysis.forward:
-        first_block = list(blocks.keys())[0]  # Entry.
-        in_edges = preds
-        out_edges = succs
+        in_start, in_edges = graph.pred_start, graph.pred
+        out_start, out_edges = graph.succ_start, graph.succ
     else:
-        first_block = list(blocks.keys())[-1]  # Exit.
-        in_edges = succs
-        out_edges = preds
+        in_start, in_edges = graph.succ_start, graph.succ
+        out_start, out_edges = graph.pred_start, graph.pred
+        order.reverse()
+    in_start, in_edges = in_start.tolist(), in_edges.tolist()
+    out_start, out_edges = out_start.tolist(), out_edges.tolist()
+    priority = [0] * n
+    for i, node in enumerate(order):
+        priority[node] = i
 
     # Initialize.
-    in_ = {first_block: analysis.init}
-    out = {node: analysis.init for node in blocks}
+    in_ = [analysis.init] * n
+    out = [analysis.init] * n
 
-    # Iterate.
-    worklist = list(blocks.keys())
+    # Iterate. The worklist holds priorities, so it starts out sorted
+    # (and therefore already a heap).
+    worklist = list(range(n))
+    pending = bytearray([1]) * n
+    transfers = pushes = 0
     while worklist:
-        node = worklist.pop(0)
+        node = order[heapq.heappop(worklist)]
+        pending[node] = 0
 
-        inval = analysis.merge(out[n] for n in in_edges[node])
+        inval = analysis.merge(
+            out[m] for m in in_edges[in_start[node]:in_start[node + 1]]
+        )
         in_[node] = inval
 
-        outval = analysis.transfer(blocks[node], inval)
+        outval = analysis.transfer(graph.blocks[node], inval)
+        transfers += 1
 
         if outval != out[node]:
             out[node] = outval
-            worklist += out_edges[node]
+            for m in out_edges[out_start[node]:out_start[node + 1]]:
+                if not pending[m]:
+                    pending[m] = 1
+                    heapq.heappush(worklist, priority[m])
+                    pushes += 1
+
+    in_ = dict(zip(graph.names, in_))
+    out = dict(zip(graph.names, out))
+
+    if stats is not None:
+        stats['transfers'] = stats.get('transfers', 0) + transfers
+        stats['pushes'] = stats.get('pushes', 0) + pushes
 
     if analysis.forward:
         return in_, out
@@ -79,6 +119,13 @@ def fmt(val):
         return str(val)
 
 
+def print_df(blocks, in_, out):
+    for block in blocks:
+        print('{}:'.format(block))
+        print('  in: ', fmt(in_[block]))
+        print('  out:', fmt(out[block]))
+
+
 def run_df(bril, analysis):
     for func in bril['functions']:
         # Form the CFG.
@@ -86,10 +133,24 @@ def run_df(bril, analysis):
         cfg.add_terminators(blocks)
 
         in_, out = df_worklist(blocks, analysis)
-        for block in blocks:
-            print('{}:'.format(block))
-            print('  in: ', fmt(in_[block]))
-            print('  out:', fmt(out[block]))
+        print_df(blocks, in_, out)
+
+
+def run_df_bits(bril, make_analysis):
+    """Like `run_df`, but for a bit-vector analysis. `make_analysis`
+    builds the `Analysis` for a CFG given the function's `VarBits`.
+    """
+    for func in bril['functions']:
+        blocks = cfg.block_map(form_blocks(func['instrs']))
+        cfg.add_terminators(blocks)
+
+        table = VarBits()
+        in_, out = df_worklist(blocks, make_analysis(blocks, table))
+        print_df(
+            blocks,
+            {b: table.decode(v) for b, v in in_.items()},
+            {b: table.decode(v) for b, v in out.items()},
+        )
 
 
 def gen(block):
@@ -164,6 +225,77 @@ ANALYSES = {
     ),
 }
 
+# Bit-vector versions of the set-based analyses. Sets of variables are
+# represented as integers, with one bit per variable in the function, so
+# merging and transferring are word-level operations. The gen and use
+# sets for each block are computed once up front (keyed by the identity
+# of the block's instruction list).
+
+
+class VarBits:
+    """Assigns variables dense bit positions, to convert between sets of
+    variable names and integer bit vectors.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+
+    def encode(self, names):
+        bits = 0
+        for name in names:
+            idx = self.index.get(name)
+            if idx is None:
+                idx = self.index[name] = len(self.names)
+                self.names.append(name)
+            bits |= 1 << idx
+        return bits
+
+    def decode(self, bits):
+        names = set()
+        while bits:
+            low = bits & -bits
+            names.add(self.names[low.bit_length() - 1])
+            bits ^= low
+        return names
+
+
+def union_bits(vals):
+    out = 0
+    for v in vals:
+        out |= v
+    return out
+
+
+def defined_bits(blocks, table):
+    gens = {id(b): table.encode(gen(b)) for b in blocks.values()}
+    return Analysis(
+        True,
+        init=0,
+        merge=union_bits,
+        transfer=lambda block, in_: in_ | gens[id(block)],
+    )
+
+
+def live_bits(blocks, table):
+    gens = {id(b): table.encode(gen(b)) for b in blocks.values()}
+    uses = {id(b): table.encode(use(b)) for b in blocks.values()}
+    return Analysis(
+        False,
+        init=0,
+        merge=union_bits,
+        transfer=lambda block, out: uses[id(block)] | (out & ~gens[id(block)]),
+    )
+
+
+BIT_ANALYSES = {
+    'defined': defined_bits,
+    'live': live_bits,
+}
+
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
-    run_df(bril, ANALYSES[sys.argv[1]])
+    bril = load()
+    if '--bits' in sys.argv[2:]:
+        run_df_bits(bril, BIT_ANALYSES[sys.argv[1]])
+    else:
+        run_df(bril, ANALYSES[sys.argv[1]])
@@ -2,7 +2,9 @@ import json
 import sys
 
 from cfg import block_map, successors, add_terminators, add_entry
+from cfg import CompactCFG
 from form_blocks import form_blocks
+from util import load
 
 
 def map_inv(succ):
@@ -18,90 +20,219 @@ def map_inv(succ):
     return out
 
 
-def postorder_helper(succ, root, explored, out):
-    """Given a successor edge map, produce a list of all the nodes in
-    the graph in postorder by appending to the `out` list.
-    """
-    if root in explored:
-        return
-    explored.add(root)
-
-    for s in succ[root]:
-        postorder_helper(succ, s, explored, out)
-    out.append(root)
-
-
 def postorder(succ, root):
+    """Given a successor edge map, produce a list of all the nodes
+    reachable from `root` in postorder.
+
+    This is a depth-first search that visits successors in order. It uses
+    an explicit stack (of nodes and iterators over their remaining
+    successors) rather than recursion, so it works on arbitrarily deep
+    graphs.
+    """
     out = []
-    postorder_helper(succ, root, set(), out)
+    explored = {root}
+    stack = [(root, iter(succ[root]))]
+    while stack:
+        node, rest = stack[-1]
+        for s in rest:
+            if s not in explored:
+                explored.add(s)
+                stack.append((s, iter(succ[s])))
+                break
+        else:
+            stack.pop()
+            out.append(node)
     return out
 
 
-def intersect(sets):
-    sets = list(sets)
-    if not sets:
-        return set()
-    out = set(sets[0])
-    for s in sets[1:]:
-        out &= s
+def compact_postorder(cfg, root=0):
+    """Like `postorder`, but for a `CompactCFG`: produce a list of the
+    IDs of all the blocks reachable from `root` in postorder.
+    """
+    succ, start = cfg.succ.tolist(), cfg.succ_start.tolist()
+    out = []
+    explored = bytearray(len(cfg))
+    explored[root] = 1
+
+    # The stack holds nodes and, in parallel, the position in `succ` of
+    # the next successor to look at for each node.
+    stack = [root]
+    edge = [start[root]]
+    while stack:
+        node = stack[-1]
+        i, end = edge[-1], start[node + 1]
+        while i < end and explored[succ[i]]:
+            i += 1
+        if i < end:
+            s = succ[i]
+            edge[-1] = i + 1
+            explored[s] = 1
+            stack.append(s)
+            edge.append(start[s])
+        else:
+            stack.pop()
+            edge.pop()
+            out.append(node)
     return out
 
 
-def get_dom(succ, entry):
-    pred = map_inv(succ)
-    nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
-
-    dom = {v: set(nodes) for v in succ}
+def compact_idom(cfg, root=0):
+    """Compute immediate dominators using the iterative algorithm from
+    Cooper, Harvey, and Kennedy's "A Simple, Fast Dominance Algorithm."
 
-    while True:
+    Work on a `CompactCFG` and return a list mapping every block ID to
+    its immediate dominator's ID. The root is its own immediate
+    dominator, and unreachable blocks map to -1.
+    """
+    # Work on indices in reverse postorder, so a block's index is always
+    # larger than its dominators' indices.
+    order = compact_postorder(cfg, root)
+    order.reverse()
+    index = [-1] * len(cfg)
+    for i, node in enumerate(order):
+        index[node] = i
+    pred, start = cfg.pred.tolist(), cfg.pred_start.tolist()
+    preds = [[index[p] for p in pred[start[node]:start[node + 1]]
+              if index[p] >= 0]
+             for node in order]
+
+    idom = [None] * len(order)
+    idom[0] = 0
+    changed = True
+    while changed:
         changed = False
-
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
-
-            if dom[node] != new_dom:
-                dom[node] = new_dom
+        for i in range(1, len(order)):
+            new_idom = None
+            for p in preds[i]:
+                if idom[p] is None:
+                    continue  # Not processed yet.
+                if new_idom is None:
+                    new_idom = p
+                    continue
+
+                # Intersect: walk up the dominator tree from both blocks
+                # until the paths meet.
+                a, b = p, new_idom
+                while a != b:
+                    while a > b:
+                        a = idom[a]
+                    while b > a:
+                        b = idom[b]
+                new_idom = a
+
+            if idom[i] != new_idom:
+                idom[i] = new_idom
                 changed = True
 
-        if not changed:
-            break
+    out = [-1] * len(cfg)
+    for i, node in enumerate(order):
+        out[node] = order[idom[i]]
+    return out
 
-    return dom
 
+def get_idom(succ, entry):
+    """Compute immediate dominators, given a successor edge map.
 
-def dom_fronts(dom, succ):
-    """Compute the dominance frontier, given the dominance relation.
+    Return a map from every block to its immediate dominator. The entry
+    is its own immediate dominator, and unreachable blocks map to None.
     """
-    dom_inv = map_inv(dom)
+    cfg = CompactCFG.from_succ(succ)
+    idom = compact_idom(cfg, cfg.ids[entry])
+    return {name: cfg.names[d] if d >= 0 else None
+            for name, d in zip(cfg.names, idom)}
+
+
+def get_dom(succ, entry, idom=None):
+    """Compute the set of dominators of every block, optionally reusing
+    already computed immediate dominators.
 
-    frontiers = {}
-    for block in dom:
-        # Find all successors of dominated blocks.
-        dominated_succs = set()
-        for dominated in dom_inv[block]:
-            dominated_succs.update(succ[dominated])
+    Every reachable block is dominated by itself and everything that
+    dominates its immediate dominator. As a convention, unreachable
+    blocks are "dominated" by every reachable block.
+    """
+    if idom is None:
+        idom = get_idom(succ, entry)
+    reachable = {node for node, d in idom.items() if d is not None}
+
+    dom = {}
+    for node in reversed(postorder(succ, entry)):  # Dominators first.
+        d = idom[node]
+        dom[node] = {node} if d == node else dom[d] | {node}
+    for node, d in idom.items():
+        if d is None:
+            dom[node] = set(reachable)
+    return {node: dom[node] for node in succ}
+
+
+def dom_fronts(idom, succ):
+    """Compute the dominance frontier, given the immediate dominators.
+
+    A block is in the frontier of every block on the dominator tree path
+    from each of its predecessors up to (but excluding) its own immediate
+    dominator.
+    """
+    pred = map_inv(succ)
+    frontiers = {block: set() for block in idom}
+
+    def up(node):
+        d = idom[node]
+        return None if d == node else d
+
+    for block, d in idom.items():
+        if d is None:
+            continue
+        stop = up(block)
+        for p in pred[block]:
+            runner = p if idom[p] is not None else None
+            while runner is not None and runner != stop:
+                frontiers[runner].add(block)
+                runner = up(runner)
+
+    # As in `get_dom`, treat unreachable blocks as dominated by every
+    # reachable block, so their reachable successors land in the frontier
+    # of every block that does not strictly dominate them.
+    for block, d in idom.items():
+        if d is None:
+            for s in succ[block]:
+                if idom[s] is None:
+                    continue
+                for other, other_d in idom.items():
+                    if other_d is not None and \
+                            (other == s or not _dominates(idom, other, s)):
+                        frontiers[other].add(s)
+
+    return {block: list(f) for block, f in frontiers.items()}
+
+
+def _dominates(idom, a, b):
+    """Check whether `a` dominates `b` by walking up the dominator tree.
+    """
+    while True:
+        if a == b:
+            return True
+        if idom[b] == b:
+            return False
+        b = idom[b]
 
-        # You're in the frontier if you're not strictly dominated by the
-        # current block.
-        frontiers[block] = [b for b in dominated_succs
-                            if b not in dom_inv[block] or b == block]
 
-    return frontiers
+def dom_tree(idom):
+    """Compute the dominator tree as a map from every block to the set
+    of blocks it immediately dominates.
+    """
+    tree = {block: set() for block in idom}
+    for block, d in idom.items():
+        if d is not None and d != block:
+            tree[d].add(block)
 
+    # Unreachable blocks are (by the `get_dom` convention) immediately
+    # dominated by every leaf of the reachable tree.
+    unreachable = {block for block, d in idom.items() if d is None}
+    if unreachable:
+        for block, d in idom.items():
+            if d is not None and not tree[block]:
+                tree[block] = set(unreachable)
 
-def dom_tree(dom):
-    # Get the blocks strictly dominated by a block strictly dominated by
-    # a given block.
-    dom_inv = map_inv(dom)
-    dom_inv_strict = {a: {b for b in bs if b != a}
-                      for a, bs in dom_inv.items()}
-    dom_inv_strict_2x = {a: set().union(*(dom_inv_strict[b] for b in bs))
-                         for a, bs in dom_inv_strict.items()}
-    return {
-        a: {b for b in bs if b not in dom_inv_strict_2x[a]}
-        for a, bs in dom_inv_strict.items()
-    }
+    return tree
 
 
 def print_dom(bril, mode):
@@ -110,14 +241,14 @@ def print_dom(bril, mode):
         add_entry(blocks)
         add_terminators(blocks)
         succ = {name: successors(block[-1]) for name, block in blocks.items()}
-        dom = get_dom(succ, list(blocks.keys())[0])
+        entry = list(blocks.keys())[0]
 
         if mode == 'front':
-            res = dom_fronts(dom, succ)
+            res = dom_fronts(get_idom(succ, entry), succ)
         elif mode == 'tree':
-            res = dom_tree(dom)
+            res = dom_tree(get_idom(succ, entry))
         else:
-            res = dom
+            res = get_dom(succ, entry)
 
         # Format as JSON for stable output.
         print(json.dumps(
@@ -128,6 +259,6 @@ def print_dom(bril, mode):
 
 if __name__ == '__main__':
     print_dom(
-        json.load(sys.stdin),
+        load(),
         'dom' if len(sys.argv) < 2 else sys.argv[1]
     )
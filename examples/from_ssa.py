@@ -1,14 +1,47 @@
-import json
 import sys
+from collections import defaultdict
+from functools import partial
+from itertools import chain
 
-from cfg import block_map, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
+from analysis import FunctionAnalyses
+from cfg import edges
+from df import df_worklist, ANALYSES
+from util import load, dump, fresh, cli_args, cli_jobs, map_functions
 
+# Ways to eliminate phi-nodes:
+# - `naive`: copy each phi argument into the phi's destination at the end
+#   of the corresponding predecessor.
+# - `parallel`: treat the phi-nodes in a block as one parallel copy per
+#   incoming edge. Critical edges are split so each copy only runs along
+#   its own edge, and each parallel copy is sequentialized so no copy
+#   clobbers another one's source (the "lost copy" and "swap" problems).
+# - `coalesce`: like `parallel`, but then give the two sides of a copy
+#   the same name when they do not interfere, which makes the copy
+#   redundant.
+MODES = ('naive', 'parallel', 'coalesce')
 
-def func_from_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
+# The placeholder `to_ssa` uses for a phi argument on a path where the
+# variable is not defined. Copying it would fail, so the copying modes
+# give the phi's destination a default value of its type along that edge
+# instead: the program never uses the value, but later copies may read
+# the variable. There are no pointer constants, so pointer-typed
+# destinations stay unassigned (with a warning); that only matters for
+# phis that are actually used, which pruned SSA avoids.
+UNDEFINED = '__undefined'
+DEFAULTS = {'int': 0, 'bool': False, 'float': 0.0, 'char': 'a'}
+
+
+def func_from_ssa(func, mode='naive', analyses=None):
+    """Convert a function out of SSA form. If `analyses` is a
+    `FunctionAnalyses` for the function, use (and update) it.
+    """
+    if analyses is None:
+        analyses = FunctionAnalyses(func)
+    if mode != 'naive':
+        func_from_ssa_copies(func, mode == 'coalesce', analyses)
+        return
+
+    blocks = analyses['blocks']
 
     # Replace each phi-node.
     for block in blocks.values():
@@ -34,14 +67,240 @@ def func_from_ssa(func):
         new_block = [i for i in block if i.get('op') != 'phi']
         block[:] = new_block
 
-    func['instrs'] = reassemble(blocks)
+    analyses.changed(cfg=False)
+
+
+def split_critical_edges(blocks):
+    """Split every critical edge (from a block with several successors to
+    a block with several predecessors) that leads to a block with
+    phi-nodes, by inserting an empty block that jumps to the target.
+    Phi-nodes are updated to refer to the new block.
+    """
+    preds, succs = edges(blocks)
+    for name in list(blocks):
+        if len(set(succs[name])) < 2:
+            continue
+        term = blocks[name][-1]
+        for succ in set(succs[name]):
+            phis = [i for i in blocks[succ] if i.get('op') == 'phi']
+            if len(set(preds[succ])) < 2 or not phis:
+                continue
+
+            split = fresh('split', blocks)
+            blocks[split] = [{'op': 'jmp', 'labels': [succ]}]
+            term['labels'] = [split if lbl == succ else lbl
+                              for lbl in term['labels']]
+            for phi in phis:
+                phi['labels'] = [split if lbl == name else lbl
+                                 for lbl in phi['labels']]
+
+
+def remove_dead_phis(blocks):
+    """Remove the phi-nodes whose results are only used by other such
+    phis, as in minimal or semi-pruned SSA.
+    """
+    phis = {i['dest']: i for block in blocks.values() for i in block
+            if i.get('op') == 'phi'}
+    live = set()
+    for block in blocks.values():
+        for instr in block:
+            if instr.get('op') != 'phi':
+                live.update(a for a in instr.get('args', []) if a in phis)
+    work = list(live)
+    while work:
+        for var in phis[work.pop()]['args']:
+            if var in phis and var not in live:
+                live.add(var)
+                work.append(var)
+    for block in blocks.values():
+        block[:] = [i for i in block
+                    if i.get('op') != 'phi' or i['dest'] in live]
+
+
+def sequentialize(copies, new_temp):
+    """Turn a parallel copy into an equivalent sequence of copies.
+
+    `copies` is a list of (dest, src) pairs with distinct destinations,
+    all of which happen at once. Return an ordered list of (dest, src)
+    pairs. A copy is emitted once no other pending copy still reads its
+    destination; when only cycles remain, one destination is saved to a
+    temporary from `new_temp(var)` to break the cycle.
+    """
+    pending = {d: s for d, s in copies if d != s}
+    readers = defaultdict(int)
+    for s in pending.values():
+        readers[s] += 1
+
+    out = []
+    ready = [d for d in pending if not readers[d]]
+    while pending:
+        while ready:
+            dest = ready.pop()
+            src = pending.pop(dest)
+            out.append((dest, src))
+            readers[src] -= 1
+            if not readers[src] and src in pending:
+                ready.append(src)
+
+        if pending:
+            # Everything left is on a cycle. Save the first destination
+            # and redirect the copy that reads it.
+            dest = next(iter(pending))
+            temp = new_temp(dest)
+            out.append((temp, dest))
+            for d, s in pending.items():
+                if s == dest:
+                    pending[d] = temp
+            readers[dest] = 0
+            ready.append(dest)
+
+    return out
+
+
+def interference(blocks, args):
+    """Build the interference graph of a (non-SSA) function: a variable
+    interferes with every variable that is live where it is written,
+    except for the source of an `id` copy.
+    """
+    live_in, live_out = df_worklist(blocks, ANALYSES['live'])
+    graph = defaultdict(set)
+
+    def _add(a, b):
+        if a != b:
+            graph[a].add(b)
+            graph[b].add(a)
+
+    for name, block in blocks.items():
+        live = set(live_out[name])
+        for instr in reversed(block):
+            if 'dest' in instr:
+                dest = instr['dest']
+                live.discard(dest)
+                copied = instr['args'][0] if instr['op'] == 'id' else None
+                for var in live:
+                    if var != copied:
+                        _add(dest, var)
+            live.update(instr.get('args', []))
+
+    # Arguments are all written on entry to the function.
+    entry = next(iter(blocks))
+    for arg in args:
+        for var in live_in[entry] | args:
+            _add(arg, var)
+
+    return graph
+
+
+def coalesce(blocks, copies, args):
+    """Merge the two sides of each copy in `copies` (a list of `id`
+    instructions) when they do not interfere, renaming variables
+    throughout the function and deleting the copies that become
+    `x = id x`. Function arguments are never renamed.
+    """
+    graph = interference(blocks, args)
+    rep = {}
+
+    def _find(var):
+        while var in rep:
+            var = rep[var]
+        return var
+
+    for instr in copies:
+        a, b = _find(instr['dest']), _find(instr['args'][0])
+        if a == b or b in graph[a] or (a in args and b in args):
+            continue
+        if a in args:
+            a, b = b, a
+
+        # Merge `a` into `b`.
+        rep[a] = b
+        for n in graph.pop(a, ()):
+            graph[n].discard(a)
+            graph[n].add(b)
+            graph[b].add(n)
+
+    for block in blocks.values():
+        for instr in block:
+            if 'args' in instr:
+                instr['args'] = [_find(a) for a in instr['args']]
+            if 'dest' in instr:
+                instr['dest'] = _find(instr['dest'])
+        block[:] = [i for i in block
+                    if not (i.get('op') == 'id' and i['args'] == [i['dest']])]
+
+
+def func_from_ssa_copies(func, coalescing=False, analyses=None):
+    """Convert a function out of SSA form with parallel copies on edges,
+    optionally coalescing variables afterward.
+    """
+    if analyses is None:
+        analyses = FunctionAnalyses(func)
+    blocks = analyses['blocks']
+    remove_dead_phis(blocks)
+    split_critical_edges(blocks)
+    preds, succs = edges(blocks)
+
+    names = {i['dest'] for b in blocks.values() for i in b if 'dest' in i}
+    args = {a['name'] for a in func.get('args', [])}
+    names |= args
+    types = {}
+
+    def _new_temp(var):
+        temp = fresh(var + '.', names)
+        names.add(temp)
+        types[temp] = types[var]
+        return temp
+
+    # Collect the parallel copy for each edge, in phi order, and the
+    # destinations to initialize because they are undefined on the edge.
+    edge_copies = defaultdict(list)
+    edge_inits = defaultdict(list)
+    for name, block in blocks.items():
+        for instr in block:
+            if instr.get('op') == 'phi':
+                dest, type = instr['dest'], instr['type']
+                types[dest] = type
+                for label, var in zip(instr['labels'], instr['args']):
+                    if var != UNDEFINED:
+                        edge_copies[label, name].append((dest, var))
+                    elif isinstance(type, str) and type in DEFAULTS:
+                        edge_inits[label, name].append(dest)
+                    else:
+                        print('warning: {} may be read before it is '
+                              'assigned in @{}; use pruned SSA'.format(
+                                  dest, func['name']), file=sys.stderr)
+        block[:] = [i for i in block if i.get('op') != 'phi']
+
+    # Place each sequentialized copy at the end of the predecessor, or at
+    # the start of the successor if the predecessor has other successors
+    # (in which case, after splitting, this is the successor's only
+    # predecessor).
+    inserted = []
+    for pred, succ in dict.fromkeys(chain(edge_copies, edge_inits)):
+        seq = [{'op': 'id', 'type': types[d], 'args': [s], 'dest': d}
+               for d, s in sequentialize(edge_copies.get((pred, succ), []),
+                                         _new_temp)]
+        inserted += seq
+        # The copies may read the old values, so initialize after them.
+        seq += [{'op': 'const', 'type': types[d],
+                 'value': DEFAULTS[types[d]], 'dest': d}
+                for d in edge_inits.get((pred, succ), [])]
+        if len(set(succs[pred])) == 1:
+            blocks[pred][-1:-1] = seq
+        else:
+            blocks[succ][0:0] = seq
+
+    if coalescing:
+        coalesce(blocks, inserted, args)
+
+    # Splitting edges changes the CFG.
+    analyses.changed()
 
 
-def from_ssa(bril):
-    for func in bril['functions']:
-        func_from_ssa(func)
-    return bril
+def from_ssa(bril, mode='naive', jobs=1):
+    return map_functions(partial(func_from_ssa, mode=mode), bril, jobs)
 
 
 if __name__ == '__main__':
-    print(json.dumps(from_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    modes = [a for a in cli_args() if a in MODES]
+    dump(from_ssa(load(), modes[0] if modes else 'naive', cli_jobs()))
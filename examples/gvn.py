@@ -0,0 +1,227 @@
+"""Global value numbering for Bril programs in SSA form.
+
+This extends the local value numbering in `lvn.py` to whole functions by
+walking the dominator tree: a value computed in one block is available in
+every block that block dominates. Because every variable in SSA form is
+assigned exactly once, a variable never gets "clobbered," so the
+canonical variable for a value number is simply the first one to hold it.
+Redundant computations become copies (or constants), which a later `tdce`
+pass can clean up.
+"""
+import sys
+from functools import partial
+
+from analysis import FunctionAnalyses
+from dom import dom_tree, postorder
+from lvn import Value, Numbering, _lookup, _canonicalize, _fold
+from util import load, dump, cli_jobs, map_functions
+
+# Operations that cannot be replaced with an earlier computation of the
+# same value: they have side effects, or their result depends on more
+# than their arguments.
+IMPURE_OPS = {'call', 'alloc', 'load'}
+
+
+def gvn_blocks(analyses, args, lookup, canonicalize, fold):
+    """Use dominator-based value numbering to optimize a CFG in SSA
+    form, given as the `FunctionAnalyses` for a function, where `args`
+    are the names of the function's arguments. Modify the instructions
+    in place. The `lookup`, `canonicalize`, and `fold` functions work as
+    in `lvn_block`.
+    """
+    blocks = analyses['blocks']
+    succ = analyses['edges'][1]
+    entry = analyses['entry']
+    idom = analyses['idom']
+    tree = dom_tree({b: d for b, d in idom.items() if d is not None})
+
+    # The value number of every variable. This is global to the
+    # function, since SSA variables are only ever written once.
+    var2num = Numbering()
+
+    # The canonical variable holding each numbered value, and the
+    # constant values for values assigned with `const`. These are also
+    # global: we only look up a number where its first definition is in
+    # scope.
+    num2var = {}
+    num2const = {}
+
+    # The numbered values available in the current block. Entries are
+    # added as we go down the dominator tree and removed when we leave a
+    # block's subtree.
+    value2num = {}
+
+    def _num(var):
+        # Function arguments (and any variables read without being
+        # defined) are their own canonical source.
+        if var not in var2num:
+            num = var2num.add(var)
+            num2var[num] = var
+        return var2num[var]
+
+    for arg in args:
+        _num(arg)
+
+    def _number_block(block):
+        """Number the values in a block. Return the list of values that
+        we added to `value2num`.
+        """
+        added = []
+        for instr in blocks[block]:
+            if instr.get('op') == 'phi':
+                _number_phi(instr, added)
+                continue
+
+            # Update argument variable names to canonical variables.
+            argnums = tuple(_num(var) for var in instr.get('args', []))
+            if 'args' in instr:
+                instr['args'] = [num2var[n] for n in argnums]
+
+            if 'dest' not in instr:
+                continue
+
+            val = None
+            if instr['op'] == 'const':
+                # Key on the representation, too, so that `0.0` and
+                # `-0.0` (which compare equal) get distinct numbers.
+                v = instr['value']
+                val = Value('const', (instr['type'], type(v).__name__,
+                                      repr(v)))
+            elif 'args' in instr and instr['op'] not in IMPURE_OPS:
+                val = canonicalize(Value(instr['op'], argnums))
+
+            # Is this value already available?
+            num = lookup(value2num, val) if val is not None else None
+            if num is not None:
+                var2num[instr['dest']] = num
+
+                # Replace the instruction with a copy or a constant.
+                if num in num2const:
+                    instr.update({
+                        'op': 'const',
+                        'value': num2const[num],
+                    })
+                    instr.pop('args', None)
+                else:
+                    instr.update({
+                        'op': 'id',
+                        'args': [num2var[num]],
+                    })
+                continue
+
+            newnum = var2num.add(instr['dest'])
+            num2var[newnum] = instr['dest']
+            if instr['op'] == 'const':
+                num2const[newnum] = instr['value']
+            elif val is not None:
+                # Is this value foldable to a constant?
+                const = fold(num2const, val)
+                if const is not None:
+                    num2const[newnum] = const
+                    instr.update({
+                        'op': 'const',
+                        'value': const,
+                    })
+                    del instr['args']
+                    continue
+
+            if val is not None:
+                value2num[val] = newnum
+                added.append(val)
+
+        # Use the canonical variables for the phi-node arguments in
+        # successors that come from this block.
+        for s in succ[block]:
+            for instr in blocks[s]:
+                if instr.get('op') != 'phi':
+                    continue
+                instr['args'] = [
+                    num2var[var2num[arg]]
+                    if label == block and arg in var2num else arg
+                    for label, arg in zip(instr['labels'], instr['args'])
+                ]
+
+        return added
+
+    def _number_phi(instr, added):
+        # Arguments that come along back edges may not be numbered yet.
+        if not all(arg in var2num for arg in instr['args']):
+            num = var2num.add(instr['dest'])
+            num2var[num] = instr['dest']
+            return
+
+        argnums = [var2num[arg] for arg in instr['args']]
+        if len(set(argnums)) == 1:
+            # A phi-node whose arguments all have the same value is just
+            # a copy of that value.
+            num = argnums[0]
+        else:
+            val = Value('phi', tuple(sorted(zip(instr['labels'], argnums))))
+            num = value2num.get(val)
+            if num is None:
+                num = var2num.add(instr['dest'])
+                num2var[num] = instr['dest']
+                value2num[val] = num
+                added.append(val)
+                return
+
+        var2num[instr['dest']] = num
+        del instr['labels']
+        if num in num2const:
+            instr.update({'op': 'const', 'value': num2const[num]})
+            del instr['args']
+        else:
+            instr.update({'op': 'id', 'args': [num2var[num]]})
+
+    # Walk the dominator tree in preorder with an explicit stack. Each
+    # entry is a block to number or, after a block's children, the values
+    # to remove from the table. Visiting children in reverse postorder
+    # means that, except along back edges, we number a block's
+    # predecessors (and so its phi-node arguments) before the block.
+    rpo = {b: i for i, b in enumerate(reversed(postorder(succ, entry)))}
+    work = [(entry, None)]
+    while work:
+        block, added = work.pop()
+        if added is not None:
+            for val in added:
+                del value2num[val]
+            continue
+
+        work.append((block, _number_block(block)))
+        for b in sorted(tree[block], key=rpo.get, reverse=True):
+            work.append((b, None))
+
+
+def gvn_func(func, prop=False, canon=False, fold=False, analyses=None):
+    """Apply global value numbering to a function in SSA form. If
+    `analyses` is a `FunctionAnalyses` for the function, use (and update)
+    it.
+    """
+    if analyses is None:
+        analyses = FunctionAnalyses(func)
+    gvn_blocks(
+        analyses,
+        [a['name'] for a in func.get('args', [])],
+        lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
+        canonicalize=_canonicalize if canon else lambda v: v,
+        fold=_fold if fold else lambda n2c, v: None,
+    )
+
+    # Only arguments and non-control instructions change.
+    analyses.changed(cfg=False)
+
+
+def gvn(bril, prop=False, canon=False, fold=False, jobs=1):
+    """Apply global value numbering to every function, optionally in
+    parallel (see `map_functions`).
+    """
+    return map_functions(
+        partial(gvn_func, prop=prop, canon=canon, fold=fold), bril, jobs,
+    )
+
+
+if __name__ == '__main__':
+    bril = load()
+    gvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv,
+        cli_jobs())
+    dump(bril)
@@ -1,11 +1,11 @@
 """Local value numbering for Bril.
 """
-import json
 import sys
 from collections import namedtuple
+from functools import partial
 
 from form_blocks import form_blocks
-from util import flatten
+from util import flatten, load, dump, cli_jobs, map_functions
 
 # A Value uniquely represents a computation in terms of sub-values.
 Value = namedtuple('Value', ['op', 'args'])
@@ -42,12 +42,11 @@ def last_writes(instrs):
     """
     out = [False] * len(instrs)
     seen = set()
-    for idx, instr in reversed(list(enumerate(instrs))):
-        if 'dest' in instr:
-            dest = instr['dest']
-            if dest not in seen:
-                out[idx] = True
-                seen.add(instr['dest'])
+    for idx in range(len(instrs) - 1, -1, -1):
+        dest = instrs[idx].get('dest')
+        if dest is not None and dest not in seen:
+            out[idx] = True
+            seen.add(dest)
     return out
 
 
@@ -91,13 +90,21 @@ def lvn_block(block, lookup, canonicalize, fold):
     # The *canonical* variable name holding a given numbered value.
     # There is only one canonical variable per value number (so this is
     # not the inverse of var2num). To make matters even more
-    # complicated, we will also keep a *list* of possible names here,
-    # where the first is the canonical one to use. This is only relevant
-    # when doing copy-propagation, and it helps with situations where a
-    # copy-propagated variable is later "clobbered" so we can fall back
-    # to a different variable holding the same value.
+    # complicated, we will also keep an *ordered set* of possible names
+    # here (a dict with None values), where the first is the canonical
+    # one to use. This is only relevant when doing copy-propagation, and
+    # it helps with situations where a copy-propagated variable is later
+    # "clobbered" so we can fall back to a different variable holding
+    # the same value.
+    #
+    # A variable only ever appears in the set for the number it holds in
+    # var2num, so var2num doubles as the index we need to find and
+    # remove a clobbered variable in constant time.
     num2vars = {}
 
+    def home(num):
+        return next(iter(num2vars[num]))
+
     # Track constant values for values assigned with `const`.
     num2const = {}
 
@@ -105,7 +112,7 @@ def lvn_block(block, lookup, canonicalize, fold):
     # variables are their own canonical source.
     for var in read_first(block):
         num = var2num.add(var)
-        num2vars[num] = [var]
+        num2vars[num] = {var: None}
 
     for instr, last_write in zip(block, last_writes(block)):
         # Look up the value numbers for all variable arguments,
@@ -115,15 +122,13 @@ def lvn_block(block, lookup, canonicalize, fold):
 
         # Update argument variable names to canonical variables.
         if 'args' in instr:
-            instr['args'] = [num2vars[n][0] for n in argnums]
+            instr['args'] = [home(n) for n in argnums]
 
         # If we write to a variable, we "clobber" any previous value it
         # may have held. Remove any entries that point to this variable
         # as the "home" for old values.
-        if 'dest' in instr:
-            for rhs in num2vars.values():
-                if instr['dest'] in rhs:
-                    rhs.remove(instr['dest'])
+        if 'dest' in instr and instr['dest'] in var2num:
+            num2vars[var2num[instr['dest']]].pop(instr['dest'], None)
 
         # Non-call value operations are candidates for replacement. (We
         # could conceivably include calls to pure functions as values,
@@ -148,11 +153,14 @@ def lvn_block(block, lookup, canonicalize, fold):
                     })
                     del instr['args']
                 else:  # Value is in a variable.
+                    # Record the destination first: for a self-copy like
+                    # `x = id x`, it is the only variable left holding
+                    # the value.
+                    num2vars[num][instr['dest']] = None
                     instr.update({
                         'op': 'id',
-                        'args': [num2vars[num][0]],
+                        'args': [home(num)],
                     })
-                    num2vars[num].append(instr['dest'])
                 continue
 
         # If this instruction produces a result, give it a number.
@@ -173,7 +181,7 @@ def lvn_block(block, lookup, canonicalize, fold):
                 var = 'lvn.{}'.format(newnum)
 
             # Record the variable name and update the instruction.
-            num2vars[newnum] = [var]
+            num2vars[newnum] = {var: None}
             instr['dest'] = var
 
             if val is not None:
@@ -202,11 +210,25 @@ def _lookup(value2num, value):
         return value2num.get(value)
 
 
+def _wrap(n):
+    """Wrap an integer to a signed 64-bit value, as Bril does.
+    """
+    return (n + 2 ** 63) % 2 ** 64 - 2 ** 63
+
+
+def _div(a, b):
+    """Integer division that truncates toward zero, as Bril does.
+    Dividing by zero raises `ZeroDivisionError`, so we never fold it.
+    """
+    q = abs(a) // abs(b)
+    return _wrap(q if (a < 0) == (b < 0) else -q)
+
+
 FOLDABLE_OPS = {
-    'add': lambda a, b: a + b,
-    'mul': lambda a, b: a * b,
-    'sub': lambda a, b: a - b,
-    'div': lambda a, b: a // b,
+    'add': lambda a, b: _wrap(a + b),
+    'mul': lambda a, b: _wrap(a * b),
+    'sub': lambda a, b: _wrap(a - b),
+    'div': _div,
     'gt': lambda a, b: a > b,
     'lt': lambda a, b: a < b,
     'ge': lambda a, b: a >= b,
@@ -260,23 +282,32 @@ def _canonicalize(value):
         return value
 
 
-def lvn(bril, prop=False, canon=False, fold=False):
+def lvn_func(func, prop=False, canon=False, fold=False):
+    """Apply the local value numbering optimization to every basic block
+    in a function.
+    """
+    blocks = list(form_blocks(func['instrs']))
+    for block in blocks:
+        lvn_block(
+            block,
+            lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
+            canonicalize=_canonicalize if canon else lambda v: v,
+            fold=_fold if fold else lambda n2c, v: None,
+        )
+    func['instrs'] = flatten(blocks)
+
+
+def lvn(bril, prop=False, canon=False, fold=False, jobs=1):
     """Apply the local value numbering optimization to every basic block
-    in every function.
+    in every function, optionally in parallel (see `map_functions`).
     """
-    for func in bril['functions']:
-        blocks = list(form_blocks(func['instrs']))
-        for block in blocks:
-            lvn_block(
-                block,
-                lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
-                canonicalize=_canonicalize if canon else lambda v: v,
-                fold=_fold if fold else lambda n2c, v: None,
-            )
-        func['instrs'] = flatten(blocks)
+    return map_functions(
+        partial(lvn_func, prop=prop, canon=canon, fold=fold), bril, jobs,
+    )
 
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
-    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
-    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    bril = load()
+    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv,
+        cli_jobs())
+    dump(bril)
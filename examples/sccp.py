@@ -0,0 +1,212 @@
+"""Sparse conditional constant propagation for Bril programs in SSA form.
+
+This is Wegman and Zadeck's algorithm. It propagates constants along SSA
+def-use edges, but only through control flow edges that may actually
+execute, so it can prove branches dead and fold the constants that
+depend on them. Every variable starts out at "top" (no information yet)
+and only moves down the lattice, to a constant and then to "bottom"
+(not a constant), so each instruction is revisited at most a couple of
+times per argument.
+
+Afterward, variables with constant values have their definitions
+replaced with `const` instructions, branches on constants become jumps,
+and unreachable blocks are deleted. The dead definitions left behind are
+a job for `tdce.py`.
+"""
+from analysis import FunctionAnalyses
+from lvn import FOLDABLE_OPS
+from util import load, dump, cli_jobs, map_functions
+
+# The top and bottom of the lattice. Anything else is a constant.
+TOP = object()
+BOTTOM = object()
+
+# The placeholder `to_ssa` uses for a phi argument on a path where the
+# variable is not defined. It may be any value, so it is "top."
+UNDEFINED = '__undefined'
+
+
+def fold(instr, args):
+    """Compute the result of a value instruction whose arguments are all
+    constants. Return None if we cannot.
+    """
+    op = instr['op']
+    if op == 'id':
+        return args[0]
+    elif op in FOLDABLE_OPS and instr['type'] in ('int', 'bool'):
+        try:
+            return FOLDABLE_OPS[op](*args)
+        except ZeroDivisionError:  # A run-time error.
+            return None
+    else:
+        return None
+
+
+def is_const(val):
+    return val is not TOP and val is not BOTTOM
+
+
+def _same(a, b):
+    # Compare constants by type and representation, so that (for
+    # example) `1` differs from `true` and `0.0` differs from `-0.0`.
+    return type(a) is type(b) and repr(a) == repr(b)
+
+
+def meet(a, b):
+    if a is TOP:
+        return b
+    elif b is TOP:
+        return a
+    elif a is BOTTOM or b is BOTTOM or not _same(a, b):
+        return BOTTOM
+    else:
+        return a
+
+
+def sccp_blocks(blocks, args, def_use):
+    """Run sparse conditional constant propagation on a CFG in SSA form,
+    where `args` are the function's argument names and `def_use` is the
+    definitions and uses of every variable (see `analysis.py`). Return
+    the lattice value for every variable and the set of executable
+    edges.
+    """
+    entry = next(iter(blocks))
+    defs, uses = def_use
+
+    # Function arguments could be anything. So could any variable that
+    # is assigned more than once (if the input is not really in SSA
+    # form); those stay at bottom no matter what their definitions say.
+    values = {var: BOTTOM for var in args}
+    values.update((var, BOTTOM) for var, d in defs.items() if len(d) > 1)
+    pinned = set(values)
+
+    executable = set()
+    exec_edges = set()
+    cfg_work = [(None, entry)]
+    ssa_work = []
+
+    def _value(var):
+        return values.get(var, TOP)
+
+    def _set(var, val):
+        old = _value(var)
+        if var in pinned or val is old or \
+           (is_const(val) and is_const(old) and _same(val, old)):
+            return
+        values[var] = val
+        ssa_work.append(var)
+
+    def _visit_phi(block, instr):
+        val = TOP
+        for label, arg in zip(instr['labels'], instr['args']):
+            if (label, block) in exec_edges and arg != UNDEFINED:
+                val = meet(val, _value(arg))
+        _set(instr['dest'], val)
+
+    def _visit(block, instr):
+        op = instr['op']
+        if op == 'phi':
+            _visit_phi(block, instr)
+        elif op == 'jmp':
+            cfg_work.append((block, instr['labels'][0]))
+        elif op == 'br':
+            # An undefined condition could go either way.
+            cond = _value(instr['args'][0])
+            if cond is TOP or cond is BOTTOM:
+                targets = instr['labels']
+            else:
+                targets = [instr['labels'][0 if cond else 1]]
+            for target in targets:
+                cfg_work.append((block, target))
+        elif 'dest' in instr:
+            if op == 'const':
+                val = instr['value']
+            else:
+                argvals = [_value(a) for a in instr.get('args', [])]
+                if 'args' not in instr or 'funcs' in instr or \
+                   any(v is BOTTOM for v in argvals):
+                    val = BOTTOM
+                elif any(v is TOP for v in argvals):
+                    val = TOP
+                else:
+                    val = fold(instr, argvals)
+                    if val is None:
+                        val = BOTTOM
+            # Values only move down the lattice.
+            _set(instr['dest'], meet(_value(instr['dest']), val))
+
+    while cfg_work or ssa_work:
+        while cfg_work:
+            edge = cfg_work.pop()
+            if edge in exec_edges:
+                continue
+            exec_edges.add(edge)
+            block = edge[1]
+            if block in executable:
+                # Only the phi-nodes can see the new edge.
+                for instr in blocks[block]:
+                    if instr.get('op') == 'phi':
+                        _visit_phi(block, instr)
+            else:
+                executable.add(block)
+                for instr in blocks[block]:
+                    _visit(block, instr)
+
+        while ssa_work:
+            var = ssa_work.pop()
+            for block, instr in uses[var]:
+                if block in executable:
+                    _visit(block, instr)
+
+    return values, exec_edges
+
+
+def func_sccp(func, analyses=None):
+    """Apply sparse conditional constant propagation to a function in SSA
+    form. If `analyses` is a `FunctionAnalyses` for the function, use
+    (and update) it.
+    """
+    if analyses is None:
+        analyses = FunctionAnalyses(func)
+    blocks = analyses['blocks']
+    args = [a['name'] for a in func.get('args', [])]
+    values, exec_edges = sccp_blocks(blocks, args, analyses['def_use'])
+    executable = {b for _, b in exec_edges}
+
+    for name in list(blocks):
+        if name not in executable:
+            # Unreachable.
+            del blocks[name]
+            continue
+
+        for instr in blocks[name]:
+            val = values.get(instr.get('dest'), TOP)
+            if is_const(val):
+                # Replace the definition of a constant.
+                for key in ('args', 'labels', 'funcs'):
+                    instr.pop(key, None)
+                instr.update({'op': 'const', 'value': val})
+            elif instr.get('op') == 'phi':
+                # Forget the arguments from edges that never execute.
+                pairs = [(label, arg) for label, arg
+                         in zip(instr['labels'], instr['args'])
+                         if (label, name) in exec_edges]
+                instr['labels'] = [label for label, _ in pairs]
+                instr['args'] = [arg for _, arg in pairs]
+            elif instr.get('op') == 'br':
+                targets = [t for t in instr['labels']
+                           if (name, t) in exec_edges]
+                if len(set(targets)) == 1:
+                    # The branch always goes the same way.
+                    instr.update({'op': 'jmp', 'labels': targets[:1]})
+                    del instr['args']
+
+    analyses.changed()
+
+
+def sccp(bril, jobs=1):
+    return map_functions(func_sccp, bril, jobs)
+
+
+if __name__ == '__main__':
+    dump(sccp(load(), cli_jobs()))
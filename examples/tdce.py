@@ -2,10 +2,12 @@
 local optimization.
 """
 
-import sys
-import json
+from collections import defaultdict
+
+from cfg import block_map, add_terminators
+from df import Analysis, df_worklist, union
 from form_blocks import form_blocks
-from util import flatten
+from util import flatten, load, dump, cli_args, cli_jobs, map_functions
 
 
 def trivial_dce_pass(func):
@@ -112,25 +114,130 @@ def trivial_dce_plus(func):
         pass
 
 
+def removable(instr):
+    """Check whether an instruction can be deleted if its result is
+    unused. Unlike the trivial passes above, we keep calls, which may have
+    side effects.
+    """
+    return 'dest' in instr and instr['op'] != 'call'
+
+
+def drop_unused(instrs):
+    """Delete removable instructions whose results are never used,
+    returning the remaining instructions.
+
+    Instead of repeating whole passes, count the uses of every variable
+    once. Deleting an instruction decrements the counts for its
+    arguments, and any variable whose count drops to zero goes on a
+    worklist so its definitions can be deleted in turn.
+    """
+    uses = defaultdict(int)
+    defs = defaultdict(list)
+    for i, instr in enumerate(instrs):
+        for var in instr.get('args', []):
+            uses[var] += 1
+        if 'dest' in instr:
+            defs[instr['dest']].append(i)
+
+    dead = [False] * len(instrs)
+    worklist = [var for var in defs if not uses[var]]
+    while worklist:
+        var = worklist.pop()
+        for i in defs[var]:
+            if dead[i] or not removable(instrs[i]):
+                continue
+            dead[i] = True
+            for arg in instrs[i].get('args', []):
+                uses[arg] -= 1
+                if not uses[arg]:
+                    worklist.append(arg)
+
+    return [instr for i, instr in enumerate(instrs) if not dead[i]]
+
+
+def strong_live_transfer(block, out):
+    """Transfer function for "strong" liveness: like ordinary liveness,
+    but the arguments of a removable instruction whose result is dead do
+    not count as uses.
+    """
+    live = set(out)
+    for instr in reversed(block):
+        if 'dest' in instr:
+            if removable(instr) and instr['dest'] not in live:
+                continue
+            live.discard(instr['dest'])
+        live.update(instr.get('args', []))
+    return live
+
+
+STRONG_LIVE = Analysis(
+    False,
+    init=set(),
+    merge=union,
+    transfer=strong_live_transfer,
+)
+
+
+def drop_dead_stores(instrs):
+    """Delete removable instructions whose results are not (strongly)
+    live afterward, anywhere in the function, returning the remaining
+    instructions. This covers both locally killed assignments and values
+    that are overwritten or unused along every path, including chains of
+    instructions that only feed each other (like a loop counter that is
+    never read).
+    """
+    # Analyze a copy of the CFG with explicit terminators. The blocks
+    # share instruction objects with `instrs`.
+    blocks = block_map(list(b) for b in form_blocks(instrs))
+    add_terminators(blocks)
+    _, live_out = df_worklist(blocks, STRONG_LIVE)
+
+    dead = set()
+    for name, block in blocks.items():
+        live = set(live_out[name])
+        for instr in reversed(block):
+            if 'dest' in instr:
+                if removable(instr) and instr['dest'] not in live:
+                    dead.add(id(instr))
+                    continue
+                live.discard(instr['dest'])
+            live.update(instr.get('args', []))
+
+    return [instr for instr in instrs if id(instr) not in dead]
+
+
+def worklist_dce(func):
+    """Delete all the dead code that `trivial_dce_plus` does (and more)
+    without iterating whole-function passes: first drop unused
+    instructions using use counts, then drop dead stores using strong
+    liveness.
+    """
+    instrs = drop_unused(func['instrs'])
+    if instrs:
+        instrs = drop_dead_stores(instrs)
+    func['instrs'] = instrs
+
+
 MODES = {
     'tdce': trivial_dce,
     'tdcep': trivial_dce_pass,
     'dkp': drop_killed_pass,
     'tdce+': trivial_dce_plus,
+    'dce': worklist_dce,
 }
 
 
 def localopt():
-    if len(sys.argv) > 1:
-        modify_func = MODES[sys.argv[1]]
+    args = cli_args()
+    if args:
+        modify_func = MODES[args[0]]
     else:
         modify_func = trivial_dce
 
     # Apply the change to all the functions in the input program.
-    bril = json.load(sys.stdin)
-    for func in bril['functions']:
-        modify_func(func)
-    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    bril = load()
+    map_functions(modify_func, bril, cli_jobs())
+    dump(bril)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+"""Generate large Bril programs to stress-test CFG traversals.
+
+Usage: `python3 gen_cfg.py SHAPE N`, where SHAPE is one of:
+
+- `chain`: N blocks in a straight line, each jumping to the next.
+- `nested`: N if-statements, each nested in the previous one's
+  then-branch, with a chain of join blocks on the way out.
+
+Either way, the dominator tree and the depth-first search are at least
+N deep, and the program prints N.
+"""
+import sys
+
+
+def chain(n):
+    yield '.l0:'
+    for i in range(n):
+        yield '  x: int = add x one;'
+        yield '  jmp .l{};'.format(i + 1)
+        yield '.l{}:'.format(i + 1)
+
+
+def nested(n):
+    for i in range(n):
+        yield '.if{}:'.format(i)
+        yield '  br c .then{} .join{};'.format(i, i)
+        yield '.then{}:'.format(i)
+        yield '  x: int = add x one;'
+    yield '  jmp .join{};'.format(n - 1)
+    for i in reversed(range(n)):
+        yield '.join{}:'.format(i)
+        yield '  jmp .{};'.format('join{}'.format(i - 1) if i else 'end')
+    yield '.end:'
+
+
+SHAPES = {
+    'chain': chain,
+    'nested': nested,
+}
+
+
+def gen_cfg(shape, n):
+    print('@main {')
+    print('  x: int = const 0;')
+    print('  one: int = const 1;')
+    print('  c: bool = const true;')
+    for line in SHAPES[shape](n):
+        print(line)
+    print('  print x;')
+    print('}')
+
+
+if __name__ == '__main__':
+    gen_cfg(sys.argv[1], int(sys.argv[2]))
@@ -1,5 +1,4 @@
-import json
-import sys
+from util import load, dump
 
 int_to_float_op_mapping = {
     "add": "fadd",
@@ -40,4 +39,4 @@ def ints_to_floats(bril_program):
 
 
 if __name__ == '__main__':
-    print(json.dumps(ints_to_floats(json.load(sys.stdin)), indent=2, sort_keys=True))
+    dump(ints_to_floats(load()))
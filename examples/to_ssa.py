@@ -1,10 +1,20 @@
-import json
 import sys
 from collections import defaultdict
+from functools import partial
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
-from dom import get_dom, dom_fronts, dom_tree
+from analysis import FunctionAnalyses
+from df import use
+from util import load, dump, cli_args, cli_jobs, map_functions
+
+# Ways to decide which phi-nodes to insert:
+# - `minimal`: for every variable at the iterated dominance frontier of
+#   its definitions.
+# - `semi`: like `minimal`, but only for "global" variables: those that
+#   are read in some block before being written there. Other variables
+#   can never need a phi-node.
+# - `pruned`: only where the variable is live on entry to the block, so
+#   every phi-node has a use.
+PHI_MODES = ('minimal', 'semi', 'pruned')
 
 
 def def_blocks(blocks):
@@ -18,18 +28,32 @@ def def_blocks(blocks):
     return dict(out)
 
 
-def get_phis(blocks, df, defs):
+def global_names(blocks):
+    """Get the set of variables that are read in some block before they
+    are written in that block.
+    """
+    out = set()
+    for block in blocks.values():
+        out |= use(block)
+    return out
+
+
+def get_phis(blocks, df, defs, live_in=None):
     """Find where to insert phi-nodes in the blocks.
 
     Produce a map from block names to variable names that need phi-nodes
     in those blocks. (We will need to generate names and actually insert
-    instructions later.)
+    instructions later.) If `live_in` maps blocks to the variables live on
+    entry to them, only insert phi-nodes for live variables.
     """
     phis = {b: set() for b in blocks}
     for v, v_defs in defs.items():
         v_defs_list = list(v_defs)
         for d in v_defs_list:
             for block in df[d]:
+                if live_in is not None and v not in live_in[block]:
+                    # A dead phi-node.
+                    continue
                 # Add a phi-node...
                 if v not in phis[block]:
                     # ..unless we already did.
@@ -40,54 +64,68 @@ def get_phis(blocks, df, defs):
 
 
 def ssa_rename(blocks, phis, succ, domtree, args):
+    # The stack of names for each variable, with the current name at the
+    # end of the list.
     stack = defaultdict(list, {v: [v] for v in args})
     phi_args = {b: {p: [] for p in phis[b]} for b in blocks}
     phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
     counters = defaultdict(int)
 
-    def _push_fresh(var):
+    def _push_fresh(var, pushed):
         fresh = '{}.{}'.format(var, counters[var])
         counters[var] += 1
-        stack[var].insert(0, fresh)
+        stack[var].append(fresh)
+        pushed.append(var)
         return fresh
 
     def _rename(block):
-        # Save stacks.
-        old_stack = {k: list(v) for k, v in stack.items()}
+        """Rename the variables in a block. Return the list of variables
+        whose stacks we pushed, to pop once the block's dominator tree
+        children are done.
+        """
+        pushed = []
 
         # Rename phi-node destinations.
         for p in phis[block]:
-            phi_dests[block][p] = _push_fresh(p)
+            phi_dests[block][p] = _push_fresh(p, pushed)
 
         for instr in blocks[block]:
             # Rename arguments in normal instructions.
             if 'args' in instr:
-                new_args = [stack[arg][0] for arg in instr['args']]
+                new_args = [stack[arg][-1] for arg in instr['args']]
                 instr['args'] = new_args
 
             # Rename destinations.
             if 'dest' in instr:
-                instr['dest'] = _push_fresh(instr['dest'])
+                instr['dest'] = _push_fresh(instr['dest'], pushed)
 
         # Rename phi-node arguments (in successors).
         for s in succ[block]:
             for p in phis[s]:
                 if stack[p]:
-                    phi_args[s][p].append((block, stack[p][0]))
+                    phi_args[s][p].append((block, stack[p][-1]))
                 else:
                     # The variable is not defined on this path
                     phi_args[s][p].append((block, "__undefined"))
 
-        # Recursive calls.
-        for b in sorted(domtree[block]):
-            _rename(b)
-
-        # Restore stacks.
-        stack.clear()
-        stack.update(old_stack)
+        return pushed
 
+    # Walk the dominator tree in preorder with an explicit stack, so deep
+    # trees do not overflow the Python stack. Each entry is a block to
+    # rename or, after a block's children, the variables to pop.
     entry = list(blocks.keys())[0]
-    _rename(entry)
+    work = [(entry, None)]
+    while work:
+        block, pushed = work.pop()
+        if pushed is not None:
+            # Restore stacks.
+            for var in pushed:
+                stack[var].pop()
+            continue
+
+        work.append((block, _rename(block)))
+        for b in sorted(domtree[block], reverse=True):
+            work.append((b, None))
 
     return phi_args, phi_dests
 
@@ -116,31 +154,59 @@ def get_types(func):
     return types
 
 
-def func_to_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
-    dom = get_dom(succ, list(blocks.keys())[0])
+def func_to_ssa(func, mode='minimal', analyses=None):
+    """Convert a function to SSA form. If `analyses` is a
+    `FunctionAnalyses` for the function, use (and update) it.
+    """
+    if analyses is None:
+        analyses = FunctionAnalyses(func)
+    blocks = analyses['blocks']
+    succ = analyses['edges'][1]
 
-    df = dom_fronts(dom, succ)
+    df = analyses['dom_fronts']
     defs = def_blocks(blocks)
     types = get_types(func)
     arg_names = {a['name'] for a in func['args']} if 'args' in func else set()
 
-    phis = get_phis(blocks, df, defs)
-    phi_args, phi_dests = ssa_rename(blocks, phis, succ, dom_tree(dom),
-                                     arg_names)
+    live_in = None
+    if mode == 'semi':
+        names = global_names(blocks)
+        defs = {v: d for v, d in defs.items() if v in names}
+    elif mode == 'pruned':
+        live_in, _ = analyses['live']
+
+    phis = get_phis(blocks, df, defs, live_in)
+    phi_args, phi_dests = ssa_rename(blocks, phis, succ,
+                                     analyses['dom_tree'], arg_names)
     insert_phis(blocks, phi_args, phi_dests, types)
 
-    func['instrs'] = reassemble(blocks)
+    # Renaming and inserting phi-nodes leaves the control flow alone.
+    analyses.changed(cfg=False)
+
 
+def to_ssa(bril, mode='minimal', jobs=1):
+    return map_functions(partial(func_to_ssa, mode=mode), bril, jobs)
 
-def to_ssa(bril):
-    for func in bril['functions']:
-        func_to_ssa(func)
-    return bril
+
+def phi_counts(bril):
+    """Count the phi-nodes in each function of a program.
+    """
+    return {
+        func['name']: sum(1 for i in func['instrs'] if i.get('op') == 'phi')
+        for func in bril['functions']
+    }
 
 
 if __name__ == '__main__':
-    print(json.dumps(to_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    args = cli_args()
+    modes = [a for a in args if a in PHI_MODES]
+    bril = to_ssa(load(), modes[0] if modes else 'minimal', cli_jobs())
+    dump(bril)
+
+    # Report the number of phi-nodes in each function.
+    if '--stats' in args:
+        counts = phi_counts(bril)
+        for name, count in counts.items():
+            print('{}: {} phis'.format(name, count), file=sys.stderr)
+        print('total: {} phis'.format(sum(counts.values())),
+              file=sys.stderr)
@@ -1,4 +1,22 @@
 import itertools
+import json
+import os
+import sys
+from concurrent import futures
+from functools import partial
+
+# Command-line flag asking a pass to emit the compact binary format
+# (from `briltxt`) instead of JSON.
+BIN_FLAG = '--bin'
+
+# Command-line flag asking a pass to optimize functions in parallel:
+# `--jobs=N` or `--jobs N` for N worker processes, or just `--jobs` for one
+# per CPU.
+JOBS_FLAG = '--jobs'
+
+# Programs with fewer functions than this are always processed serially,
+# since starting a process pool would cost more than it saves.
+PARALLEL_THRESHOLD = 64
 
 
 def flatten(ll):
@@ -16,3 +34,103 @@ def fresh(seed, names):
         if name not in names:
             return name
         i += 1
+
+
+def load():
+    """Read a Bril program from standard input. The input may be either
+    JSON or the binary format; we detect which automatically.
+    """
+    data = sys.stdin.buffer.read()
+    if not data.strip():
+        raise ValueError('no input: expected a Bril program on standard '
+                         'input')
+    if data[:1] == b'{' or data[:1].isspace():
+        return json.loads(data)
+    else:
+        import briltxt
+        return briltxt.loads_bin(data)
+
+
+def dump(bril):
+    """Write a Bril program to standard output: as JSON by default, or in
+    the binary format if the `--bin` flag was given.
+    """
+    if BIN_FLAG in sys.argv[1:]:
+        import briltxt
+        sys.stdout.buffer.write(briltxt.dumps_bin(bril))
+    else:
+        print(json.dumps(bril, indent=2, sort_keys=True))
+
+
+def _split_jobs(argv):
+    """Separate the `--jobs` flag from the rest of a command line. The
+    flag may be given as `--jobs=N`, `--jobs N`, or just `--jobs`.
+    Return the number of jobs (1 by default, or None for one per CPU)
+    and the remaining arguments.
+    """
+    jobs = 1
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == JOBS_FLAG:
+            jobs = None
+            # Take a following number as the flag's value.
+            value = next(args, None)
+            if value is not None and value.isdigit():
+                jobs = int(value)
+            elif value is not None:
+                rest.append(value)
+        elif arg.startswith(JOBS_FLAG + '='):
+            jobs = int(arg[len(JOBS_FLAG) + 1:])
+        else:
+            rest.append(arg)
+    return jobs, rest
+
+
+def cli_jobs():
+    """Get the number of worker processes requested with `--jobs` on the
+    command line: 1 (serial) by default, or None for one per CPU.
+    """
+    return _split_jobs(sys.argv[1:])[0]
+
+
+def cli_args():
+    """Get the command-line arguments, excluding the `--bin` and `--jobs`
+    flags (and the value of `--jobs`).
+    """
+    return [a for a in _split_jobs(sys.argv[1:])[1] if a != BIN_FLAG]
+
+
+def _apply(func_pass, func):
+    func_pass(func)
+    return func
+
+
+def map_functions(func_pass, bril, jobs=1, threshold=PARALLEL_THRESHOLD):
+    """Apply `func_pass`, which modifies a single function in place, to
+    every function in a program.
+
+    If `jobs` is more than 1 (or None, for one per CPU) and the program
+    has at least `threshold` functions, distribute the functions in
+    chunks across a pool of worker processes. In that case, `func_pass`
+    must be picklable (a module-level function or a `functools.partial`
+    of one) and the program's function list is replaced with the
+    modified copies, in the original order.
+    """
+    funcs = bril['functions']
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs <= 1 or len(funcs) < threshold:
+        for func in funcs:
+            func_pass(func)
+        return bril
+
+    # A few chunks per worker balances the load without paying to
+    # pickle every function as a separate task.
+    chunksize = max(1, len(funcs) // (jobs * 4))
+    with futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        bril['functions'] = list(pool.map(
+            partial(_apply, func_pass), funcs, chunksize=chunksize,
+        ))
+    return bril